@@ -0,0 +1,145 @@
+import argparse
+import logging
+import os
+import sys
+
+import torch
+import torch.nn.functional as F
+import yaml
+
+try:
+    from ultralytics import YOLO
+except ImportError:
+    print("Error: ultralytics not installed. Please install it using 'pip3 install ultralytics'")
+    sys.exit(1)
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("ExportEngine")
+
+def count_cameras(config_path):
+    """
+    Number of enabled cameras in the config, used as the engine batch size.
+    """
+    with open(config_path, 'r') as f:
+        config = yaml.safe_load(f)
+    return max(1, sum(1 for cam in config.get('cameras', []) if cam.get('enabled', True)))
+
+class FusedPreprocess(torch.nn.Module):
+    """
+    Wraps a YOLO network so the graph accepts raw uint8 NHWC BGR frames and
+    performs the channel swap, normalization and resize itself.
+    """
+    def __init__(self, model, img_size):
+        super().__init__()
+        self.model = model
+        self.img_size = img_size
+
+    def forward(self, x):
+        x = x.permute(0, 3, 1, 2).flip(1).to(torch.float32).div(255.0)
+        x = F.interpolate(x, size=(self.img_size, self.img_size), mode='bilinear', align_corners=False)
+        return self.model(x)
+
+def export_fused_onnx(model_path, output_path, img_size=640, frame_size=(1080, 1920)):
+    """
+    Export an ONNX graph with preprocessing folded in (uint8 NHWC input, dynamic batch).
+    Build the engine from it with trtexec, e.g.:
+        trtexec --onnx=model_fused.onnx --fp16 --saveEngine=model_fused.engine
+    Args:
+        model_path (str): Path to the input .pt file.
+        output_path (str): Path where the .onnx file will be saved.
+        img_size (int): Network input size the frames are resized to.
+        frame_size (tuple): (height, width) of the dummy frame used for tracing.
+    Returns:
+        Path to the exported ONNX file, or None on failure.
+    """
+    if not os.path.exists(model_path):
+        logger.error(f"Model file not found: {model_path}")
+        return None
+
+    try:
+        logger.info(f"Loading model: {model_path}")
+        net = YOLO(model_path).model.fuse().eval()
+        # Same switch the Ultralytics exporter flips: heads return plain tensors
+        for m in net.modules():
+            if hasattr(m, 'export'):
+                m.export = True
+                m.format = 'onnx'
+
+        wrapper = FusedPreprocess(net, img_size).eval()
+        dummy = torch.zeros((1, *frame_size, 3), dtype=torch.uint8)
+
+        logger.info(f"Exporting fused-preprocess ONNX to {output_path}...")
+        torch.onnx.export(
+            wrapper, dummy, output_path, opset_version=17,
+            input_names=['images'], output_names=['output0', 'output1'],
+            dynamic_axes={'images': {0: 'batch', 1: 'height', 2: 'width'},
+                          'output0': {0: 'batch'}, 'output1': {0: 'batch'}},
+        )
+        return output_path
+
+    except Exception as e:
+        logger.error(f"Export failed with exception: {e}")
+        return None
+
+def export_engine(model_path, batch=1, img_size=640, half=True):
+    """
+    Export a YOLOv8 .pt model to a TensorRT .engine for Jetson inference.
+
+    Args:
+        model_path (str): Path to the input .pt file.
+        batch (int): Maximum batch size (one slot per camera).
+        img_size (int): Square input image size.
+        half (bool): Build the engine in FP16.
+    Returns:
+        Path to the exported engine, or None on failure.
+    """
+    if not os.path.exists(model_path):
+        logger.error(f"Model file not found: {model_path}")
+        return None
+
+    try:
+        logger.info(f"Loading model: {model_path}")
+        model = YOLO(model_path)
+
+        logger.info(f"Exporting to TensorRT (imgsz={img_size}, batch={batch}, half={half})...")
+        # dynamic=True makes `batch` the max of the optimization profile (min 1),
+        # so ticks with fewer due cameras can still run without padding.
+        exported_path = model.export(format='engine', imgsz=img_size, batch=batch,
+                                     dynamic=batch > 1, half=half, device=0)
+
+        if exported_path and os.path.exists(exported_path):
+            logger.info(f"Engine located at: {exported_path}")
+            return exported_path
+
+        logger.error("Export failed.")
+        return None
+
+    except Exception as e:
+        logger.error(f"Export failed with exception: {e}")
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export YOLOv8 model to TensorRT engine for Jetson")
+    parser.add_argument("--model", type=str, default="models/yolov8s-seg.pt", help="Path to .pt model")
+    parser.add_argument("--config", type=str, default="config/config.yaml", help="Config used to derive the batch size")
+    parser.add_argument("--batch", type=int, default=None, help="Override batch size (default: number of enabled cameras)")
+    parser.add_argument("--imgsz", type=int, default=640, help="Input image size")
+    parser.add_argument("--fp32", action="store_true", help="Disable FP16 and build an FP32 engine")
+    parser.add_argument("--fuse-preprocess", action="store_true",
+                        help="Only export an ONNX that takes raw uint8 NHWC frames (for trtexec/DeepStream)")
+
+    args = parser.parse_args()
+
+    if args.fuse_preprocess:
+        onnx_path = os.path.splitext(args.model)[0] + '_fused.onnx'
+        if not export_fused_onnx(args.model, onnx_path, img_size=args.imgsz):
+            sys.exit(1)
+        sys.exit(0)
+
+    batch = args.batch
+    if batch is None:
+        batch = count_cameras(args.config) if os.path.exists(args.config) else 1
+
+    if not export_engine(args.model, batch=batch, img_size=args.imgsz, half=not args.fp32):
+        sys.exit(1)
@@ -1,55 +1,118 @@
+import os
 import cv2
 import time
 import threading
 import numpy as np
 import logging
-from queue import Queue, Empty
+from queue import Queue, Empty, Full
 
 logger = logging.getLogger("CameraManager")
 
+def cuda_available():
+    """
+    True if this OpenCV build was compiled with CUDA and sees a device.
+    """
+    try:
+        return cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except (AttributeError, cv2.error):
+        return False
+
 class MotionDetector:
     def __init__(self, config):
         self.enabled = config.get('enabled', False)
         self.threshold = config.get('threshold', 25)
         self.min_area = config.get('min_area', 500)
-        self.bg_subtractor = cv2.createBackgroundSubtractorMOG2(history=500, varThreshold=16, detectShadows=False)
+        # Motion is coarse, so run the subtractor on a downscaled frame
+        self.scale = config.get('scale', 0.25)
+        # min_area is given in full-resolution pixels
+        self.scaled_min_area = self.min_area * self.scale * self.scale
+
+        # Structuring element for the noise-removing opening, built once
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+
+        # Run MOG2 on the GPU when OpenCV was built with CUDA (JetPack OpenCV may not be)
+        self.use_cuda = config.get('use_cuda', True) and cuda_available()
+        if self.use_cuda:
+            self.bg_subtractor = cv2.cuda.createBackgroundSubtractorMOG2(history=500, varThreshold=16, detectShadows=False)
+            self.morph_filter = cv2.cuda.createMorphologyFilter(cv2.MORPH_OPEN, cv2.CV_8UC1, self._kernel)
+            self.stream = cv2.cuda_Stream()
+            self.gpu_frame = cv2.cuda_GpuMat()
+            logger.info("Motion detection running on CUDA.")
+        else:
+            self.bg_subtractor = cv2.createBackgroundSubtractorMOG2(history=500, varThreshold=16, detectShadows=False)
 
     def detect(self, frame):
         if not self.enabled:
             return True
 
+        if self.use_cuda:
+            fg_mask = self._foreground_cuda(frame)
+        else:
+            fg_mask = self._foreground_cpu(frame)
+
+        # Area of every blob in one pass (label 0 is the background)
+        _, _, stats, _ = cv2.connectedComponentsWithStats(fg_mask, connectivity=8, ltype=cv2.CV_32S)
+        return bool(stats.shape[0] > 1 and stats[1:, cv2.CC_STAT_AREA].max() > self.scaled_min_area)
+
+    def _foreground_cpu(self, frame):
+        if self.scale != 1.0:
+            frame = cv2.resize(frame, (0, 0), fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        # MOG2 on one channel: a third of the pixels and a smaller background model
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
         # Apply background subtraction
-        fg_mask = self.bg_subtractor.apply(frame)
+        fg_mask = self.bg_subtractor.apply(gray)
 
         # Remove noise
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-        fg_mask = cv2.morphologyEx(fg_mask, cv2.MORPH_OPEN, kernel)
+        return cv2.morphologyEx(fg_mask, cv2.MORPH_OPEN, self._kernel)
 
-        # Find contours
-        contours, _ = cv2.findContours(fg_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    def _foreground_cuda(self, frame):
+        # Upload once; resize, subtraction and morphology all stay on the GPU
+        self.gpu_frame.upload(frame, self.stream)
+        gpu = self.gpu_frame
+        if self.scale != 1.0:
+            h, w = frame.shape[:2]
+            gpu = cv2.cuda.resize(gpu, (int(w * self.scale), int(h * self.scale)),
+                                  interpolation=cv2.INTER_AREA, stream=self.stream)
 
-        for contour in contours:
-            if cv2.contourArea(contour) > self.min_area:
-                return True
-        
-        return False
+        gpu = cv2.cuda.cvtColor(gpu, cv2.COLOR_BGR2GRAY, stream=self.stream)
+
+        fg_gpu = self.bg_subtractor.apply(gpu, -1.0, self.stream)
+        fg_gpu = self.morph_filter.apply(fg_gpu, stream=self.stream)
+
+        # Only the small downscaled mask comes back to the host
+        fg_mask = fg_gpu.download(stream=self.stream)
+        self.stream.waitForCompletion()
+        return fg_mask
 
 class CameraStream:
-    def __init__(self, camera_config, motion_config=None):
+    def __init__(self, camera_config, motion_config=None, frame_queue=None):
         self.id = camera_config['id']
         self.url = camera_config['url']
         self.name = camera_config.get('name', self.id)
+        # Hardware (nvdec) decoding for RTSP sources via GStreamer
+        self.hw_decode = camera_config.get('hw_decode', True)
+        self.codec = camera_config.get('codec', 'h264')
         self.reconnect_interval = 5
         self.running = False
         self.thread = None
-        self.lock = threading.Lock()
-        self.latest_frame = None
+        # Ring of reused frames: the capture thread fills slot _seq % ring_size, then
+        # publishes it by bumping _seq (a single int store, atomic under the GIL).
+        # A slot is only rewritten ring_size - 1 publishes after it was published.
+        self.ring_size = max(3, camera_config.get('ring_size', 3))
+        self._slots = [None] * self.ring_size
+        # Publish counter and the value seen by the last get_frame()
+        self._seq = 0
+        self._last_read_seq = 0
         self.last_access_time = 0
         self.connected = False
         
         # Motion detection
         self.motion_detector = MotionDetector(motion_config if motion_config else {})
         self.motion_detected = False
+
+        # Shared queue of camera ids, signalled each time a frame is published
+        self.frame_queue = frame_queue
         
     def start(self):
         if self.running:
@@ -73,6 +136,44 @@ class CameraStream:
             return True
         return self.motion_detector.detect(frame)
 
+    def _gst_pipeline(self):
+        """
+        Build a GStreamer pipeline that decodes the RTSP stream on the Jetson's
+        hardware decoder (nvv4l2decoder) and converts on the VIC (nvvidconv).
+        """
+        depay = 'rtph265depay ! h265parse' if self.codec == 'h265' else 'rtph264depay ! h264parse'
+        return (
+            f"rtspsrc location={self.url} latency=0 ! {depay} ! nvv4l2decoder ! "
+            "nvvidconv ! video/x-raw,format=BGRx ! videoconvert ! video/x-raw,format=BGR ! "
+            "appsink drop=true max-buffers=1 sync=false"
+        )
+
+    def _open_capture(self, url_to_open):
+        """
+        Open the capture device, preferring hardware decode for RTSP streams.
+        Falls back to the default OpenCV backend if GStreamer is unavailable.
+        """
+        if self.hw_decode and isinstance(url_to_open, str) and url_to_open.startswith('rtsp://'):
+            cap = cv2.VideoCapture(self._gst_pipeline(), cv2.CAP_GSTREAMER)
+            if cap.isOpened():
+                return cap
+            logger.warning(f"Camera {self.name}: GStreamer hardware decode unavailable, using FFMPEG backend.")
+            cap.release()
+
+        if isinstance(url_to_open, int):
+            # Webcam index: let OpenCV pick the native backend (V4L2)
+            cap = cv2.VideoCapture(url_to_open)
+        else:
+            # Low-latency RTSP: TCP transport and no demuxer buffering (user overrides win)
+            os.environ.setdefault('OPENCV_FFMPEG_CAPTURE_OPTIONS', 'rtsp_transport;tcp|fflags;nobuffer')
+            cap = cv2.VideoCapture(url_to_open, cv2.CAP_FFMPEG, [
+                cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, self.reconnect_interval * 1000,
+                cv2.CAP_PROP_READ_TIMEOUT_MSEC, self.reconnect_interval * 1000,
+            ])
+        # Keep at most one decoded frame queued so we always read the newest one
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
     def _update(self):
         # Handle numeric string for webcam index
         url_to_open = self.url
@@ -80,39 +181,44 @@ class CameraStream:
             url_to_open = int(self.url)
 
         if url_to_open == "test":
+            # Generate dummy frames into one reused buffer
+            frame = np.empty((640, 640, 3), dtype=np.uint8)
             while self.running:
-                # Generate dummy frame
-                frame = np.zeros((640, 640, 3), dtype=np.uint8)
                 cv2.randu(frame, 0, 255)
-                with self.lock:
-                    self.latest_frame = frame
-                    self.connected = True
+                self._publish(frame)
+                self.connected = True
                 time.sleep(1/15) # 15 FPS
             return
 
-        cap = cv2.VideoCapture(url_to_open)
+        cap = self._open_capture(url_to_open)
         while self.running:
             if not cap.isOpened():
                 self.connected = False
                 logger.warning(f"Camera {self.name} disconnected. Retrying in {self.reconnect_interval}s...")
                 time.sleep(self.reconnect_interval)
-                cap = cv2.VideoCapture(url_to_open)
+                cap = self._open_capture(url_to_open)
                 continue
             
             self.connected = True
-            ret, frame = cap.read()
+            # Decode straight into the next ring slot instead of a fresh array.
+            # retrieve() reallocates only if the stream resolution changed.
+            slot = self._seq % self.ring_size
+            ret = cap.grab()
+            if ret:
+                ret, frame = cap.retrieve(self._slots[slot])
             
             if not ret:
                 self.connected = False
                 logger.warning(f"Camera {self.name} failed to read frame. Reconnecting...")
                 cap.release()
                 time.sleep(self.reconnect_interval)
-                cap = cv2.VideoCapture(url_to_open)
+                cap = self._open_capture(url_to_open)
                 continue
             
-            # Store latest frame safely
-            with self.lock:
-                self.latest_frame = frame.copy()
+            # Publish the slot
+            self._slots[slot] = frame
+            self._seq += 1
+            self._notify()
             
             # Optional: Sleep to limit capture FPS if needed to save CPU, 
             # but usually we want to clear the buffer so we read as fast as possible 
@@ -121,20 +227,66 @@ class CameraStream:
             
         cap.release()
 
+    def _publish(self, frame):
+        """
+        Copy the frame into the next ring slot and publish it.
+        """
+        slot = self._seq % self.ring_size
+        buf = self._slots[slot]
+        if buf is None or buf.shape != frame.shape:
+            buf = np.empty_like(frame)
+            self._slots[slot] = buf
+        np.copyto(buf, frame)
+        self._seq += 1
+        self._notify()
+
+    def _notify(self):
+        """
+        Tell the consumer a new frame is available. Never blocks: if the queue
+        is full the oldest notification is dropped to make room.
+        """
+        if self.frame_queue is None:
+            return
+        try:
+            self.frame_queue.put_nowait(self.id)
+        except Full:
+            try:
+                self.frame_queue.get_nowait()
+            except Empty:
+                pass
+            try:
+                self.frame_queue.put_nowait(self.id)
+            except Full:
+                pass
+
     def get_frame(self):
-        with self.lock:
-            if self.latest_frame is None:
+        """
+        Return a private copy of the most recently published frame, or None if
+        nothing new was published since the previous call.
+        The copy is validated against the publish counter: if the capture thread
+        may have started rewriting the slot while it was copied, it is retried
+        with the newer frame, so callers never see a torn frame.
+        """
+        while True:
+            seq = self._seq
+            if seq == self._last_read_seq:
                 return None
-            return self.latest_frame.copy()
+            frame = self._slots[(seq - 1) % self.ring_size].copy()
+            # The slot of frame seq is rewritten once the counter reaches seq + ring_size - 1
+            if self._seq - seq < self.ring_size - 1:
+                self._last_read_seq = seq
+                return frame
 
 class CameraManager:
     def __init__(self, config):
         self.cameras = {}
         motion_config = config.get('motion_detection', {})
-        for cam_conf in config['cameras']:
-            if cam_conf.get('enabled', True):
-                cam = CameraStream(cam_conf, motion_config)
-                self.cameras[cam.id] = cam
+        enabled = [cam_conf for cam_conf in config['cameras'] if cam_conf.get('enabled', True)]
+        # Capture threads push their id here on every new frame
+        self.frame_queue = Queue(maxsize=max(1, len(enabled)) * 2)
+        for cam_conf in enabled:
+            cam = CameraStream(cam_conf, motion_config, self.frame_queue)
+            self.cameras[cam.id] = cam
     
     def start_all(self):
         for cam in self.cameras.values():
@@ -144,13 +296,34 @@ class CameraManager:
         for cam in self.cameras.values():
             cam.stop()
             
-    def get_frames(self):
-        frames = {}
-        for cam_id, cam in self.cameras.items():
-            frame = cam.get_frame()
-            if frame is not None:
-                frames[cam_id] = frame
-        return frames
+    def wait_for_frames(self, timeout=1.0, window=0.005):
+        """
+        Block until at least one camera publishes a frame, then keep collecting
+        arrivals for a short window so they can be batched together.
+        Returns:
+            Set of camera ids with a new frame (empty on timeout).
+        """
+        try:
+            ready = {self.frame_queue.get(timeout=timeout)}
+        except Empty:
+            return set()
+
+        deadline = time.monotonic() + window
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                ready.add(self.frame_queue.get(timeout=remaining))
+            except Empty:
+                break
+        return ready
+
+    def get_frame(self, camera_id):
+        """
+        Private copy of one camera's latest frame (see CameraStream.get_frame).
+        """
+        return self.cameras[camera_id].get_frame()
 
     def check_motion(self, camera_id, frame):
         """
@@ -161,7 +334,7 @@ class CameraManager:
         return True
             
     def get_frames(self):
-        """Returns a dict of {camera_id: frame} for all connected cameras"""
+        """Returns a dict of {camera_id: frame} for cameras with a frame not yet read"""
         frames = {}
         for cam_id, cam in self.cameras.items():
             frame = cam.get_frame()
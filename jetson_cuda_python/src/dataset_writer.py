@@ -10,6 +10,14 @@ from .utils import ensure_directories
 
 logger = logging.getLogger("DatasetWriter")
 
+try:
+    # nvjpeg-backed encoder; CUDA tensors are supported from torchvision 0.19
+    import torch
+    from torchvision.io import encode_jpeg
+    NVJPEG_AVAILABLE = torch.cuda.is_available()
+except ImportError:
+    NVJPEG_AVAILABLE = False
+
 class DatasetWriter:
     def __init__(self, config):
         self.config = config['storage']
@@ -19,6 +27,9 @@ class DatasetWriter:
         self.images_dir = self.config['images_dir']
         self.labels_dir = self.config['labels_dir']
         self.db_path = os.path.join(self.base_path, self.config.get('database_path', 'datacollector.db'))
+        self.jpeg_quality = self.config.get('jpeg_quality', 95)
+        # Encode JPEGs on the GPU (nvjpeg) instead of libjpeg on the CPU
+        self.use_nvjpeg = NVJPEG_AVAILABLE and self.config.get('gpu_jpeg', True)
         
         self.setup_directories()
         self.setup_database()
@@ -82,7 +93,7 @@ class DatasetWriter:
         lbl_full_path = os.path.join(self.base_path, lbl_rel_path)
         
         # Save Image
-        cv2.imwrite(img_full_path, frame)
+        self.write_image(img_full_path, frame)
         
         # Save Label
         with open(lbl_full_path, 'w') as f:
@@ -93,6 +104,25 @@ class DatasetWriter:
         
         logger.debug(f"Saved sample {frame_id} to {split}")
 
+    def write_image(self, path, frame):
+        """
+        Encode a BGR frame to JPEG, on the GPU when nvjpeg is available.
+        """
+        if self.use_nvjpeg:
+            try:
+                # HWC BGR -> CHW RGB on the device, then nvjpeg encode
+                tensor = torch.from_numpy(frame).to('cuda').permute(2, 0, 1).flip(0).contiguous()
+                data = encode_jpeg(tensor, quality=self.jpeg_quality)
+                with open(path, 'wb') as f:
+                    f.write(data.cpu().numpy().tobytes())
+                return
+            except (RuntimeError, TypeError) as e:
+                # Older torchvision only encodes CPU tensors
+                logger.warning(f"GPU JPEG encoding unavailable, falling back to OpenCV: {e}")
+                self.use_nvjpeg = False
+
+        cv2.imwrite(path, frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+
     def log_to_db(self, frame_id, camera_id, timestamp, split, img_path, lbl_path, count, classes):
         try:
             conn = sqlite3.connect(self.db_path)
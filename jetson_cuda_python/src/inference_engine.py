@@ -1,7 +1,9 @@
+import os
 import logging
 import cv2
 import numpy as np
 import torch
+import torch.nn.functional as F
 
 logger = logging.getLogger("InferenceEngineJetson")
 
@@ -27,8 +29,23 @@ class InferenceEngineJetson:
         self.config = config['inference']
         self.model_path = self.config['model_path'] # Can be .pt or .engine
         self.score_threshold = self.config.get('score_threshold', 0.5)
+        self.imgsz = self.config.get('input_shape', [640, 640])[0]
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        # One batch slot per enabled camera unless capped explicitly
+        num_cameras = max(1, sum(1 for cam in config.get('cameras', []) if cam.get('enabled', True)))
+        self.max_batch = self.config.get('max_batch', num_cameras)
+        # Build a TensorRT FP16 engine next to the .pt on first run
+        self.auto_export = self.config.get('auto_export_engine', True)
         self.model = None
+        # Optional device-side detection filter, see set_filter()
+        self.min_score = self.score_threshold
+        self.target_ids = None
+
+        # Persistent page-locked staging buffer for the host-to-device copy.
+        # Pinned once and reused; pinning per call would cost more than it saves.
+        self.pinned = None
+        if self.device == 'cuda' and self.config.get('pinned_upload', True):
+            self.pinned = torch.empty((self.max_batch, self.imgsz, self.imgsz, 3), dtype=torch.uint8, pin_memory=True)
         
         if ULTRALYTICS_AVAILABLE:
             self._init_model()
@@ -40,15 +57,52 @@ class InferenceEngineJetson:
         Load the YOLO model and perform warmup.
         """
         try:
+            if self.auto_export and self.device == 'cuda' and self.model_path.endswith('.pt'):
+                self.model_path = self._export_engine(self.model_path)
+
             logger.info(f"Loading YOLO model from {self.model_path} on {self.device}...")
             self.model = YOLO(self.model_path)
-            # Warmup
-            self.model(np.zeros((640, 640, 3), dtype=np.uint8), verbose=False)
+
+            # Inference only: no autograd bookkeeping anywhere in this process
+            torch.set_grad_enabled(False)
+
+            if self.device == 'cuda':
+                # Let cuDNN pick the fastest (NHWC) conv kernels for our fixed input size
+                torch.backends.cudnn.benchmark = True
+                # TF32 tensor-core math on Ampere (Orin); ignored on older Jetsons
+                torch.backends.cuda.matmul.allow_tf32 = True
+                torch.backends.cudnn.allow_tf32 = True
+                # Tensor cores prefer channels_last; only applies to PyTorch (.pt) weights
+                if isinstance(self.model.model, torch.nn.Module):
+                    self.model.model.to(memory_format=torch.channels_last)
+            # Warmup with a full batch so TensorRT selects the right profile
+            warmup = [np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)] * self.max_batch
+            self.infer_batch(warmup)
             logger.info("Model loaded and warmed up.")
         except Exception as e:
             logger.error(f"Failed to load model: {e}")
             self.model = None
 
+    def _export_engine(self, pt_path):
+        """
+        Export a .pt model to a TensorRT FP16 .engine once and return its path.
+        Falls back to the .pt path if the export fails.
+        """
+        engine_path = os.path.splitext(pt_path)[0] + '.engine'
+        if os.path.exists(engine_path):
+            return engine_path
+
+        try:
+            logger.info(f"No TensorRT engine found. Exporting {pt_path} (batch={self.max_batch}, FP16); this can take several minutes...")
+            exported = YOLO(pt_path).export(format='engine', half=True, imgsz=self.imgsz,
+                                            batch=self.max_batch, dynamic=self.max_batch > 1,
+                                            device=0, verbose=False)
+            if exported and os.path.exists(exported):
+                return exported
+        except Exception as e:
+            logger.error(f"TensorRT export failed, using PyTorch model: {e}")
+        return pt_path
+
     def _init_mock(self):
         """
         Initialize Mock engine if dependencies are missing.
@@ -69,6 +123,19 @@ class InferenceEngineJetson:
         # No specific cleanup needed for PyTorch model
         pass
 
+    def set_filter(self, min_score=None, target_ids=None):
+        """
+        Filter detections on the device before masks are resized and copied back.
+        Args:
+            min_score: Minimum confidence to keep (defaults to score_threshold).
+            target_ids: Iterable of class ids to keep, or None to keep all classes.
+        """
+        self.min_score = max(self.score_threshold, min_score or 0.0)
+        if target_ids is None:
+            self.target_ids = None
+        else:
+            self.target_ids = torch.tensor(sorted(target_ids), dtype=torch.long, device=self.device)
+
     def infer(self, frame):
         """
         Run inference on a single frame.
@@ -77,54 +144,138 @@ class InferenceEngineJetson:
         Returns: 
             Tuple (masks, class_ids, scores)
         """
+        return self.infer_batch([frame])[0]
+
+    @torch.inference_mode()
+    def infer_batch(self, frames):
+        """
+        Run inference on a batch of frames in a single forward pass.
+        Args:
+            frames: List of input images (may differ in resolution).
+        Returns:
+            List of (masks, class_ids, scores) tuples, one per input frame.
+        """
         if self.model is None:
-            return self.mock_inference(frame.shape)
+            return [self.mock_inference(frame.shape) for frame in frames]
 
-        # Run inference
-        # stream=True for performance, verbose=False to reduce logs
-        results = self.model(frame, conf=self.score_threshold, verbose=False, device=self.device)
-        
-        if not results:
-            return [], [], []
+        if self.pinned is None:
+            # Ultralytics accepts a list of images and runs them as one batch,
+            # so kernel launches are shared across all cameras.
+            results = self.model(frames, conf=self.score_threshold, verbose=False, device=self.device)
+            return [self._extract(result, frame.shape[:2]) for result, frame in zip(results, frames)]
 
-        result = results[0] # Single frame
-        
+        # More frames than the engine batch size are split into micro-batches
+        outputs = []
+        for start in range(0, len(frames), self.max_batch):
+            chunk = frames[start:start + self.max_batch]
+            tensor, crops = self._upload(chunk)
+            results = self.model(tensor, conf=self.score_threshold, verbose=False, device=self.device)
+            outputs.extend(self._extract(result, frame.shape[:2], crop)
+                           for result, frame, crop in zip(results, chunk, crops))
+        return outputs
+
+    def _upload(self, frames):
+        """
+        Letterbox frames into the pinned staging buffer and copy them to the GPU.
+        Each frame is scaled to fit imgsz x imgsz with its aspect ratio kept and
+        padded with gray (114), the same way Ultralytics prepares its inputs.
+        Returns:
+            Tuple (tensor, crops): float tensor (N, 3, H, W) in RGB order scaled to
+            [0, 1], and per frame the (top, left, height, width) of the image area.
+        """
+        # The previous chunk's copy may still be reading the staging buffer
+        torch.cuda.current_stream().synchronize()
+        staging = self.pinned[:len(frames)]
+        crops = []
+        for i, frame in enumerate(frames):
+            h, w = frame.shape[:2]
+            scale = min(self.imgsz / h, self.imgsz / w)
+            new_h, new_w = round(h * scale), round(w * scale)
+            top, left = (self.imgsz - new_h) // 2, (self.imgsz - new_w) // 2
+            resized = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+            # Writes straight into the pinned memory through a zero-copy numpy view
+            cv2.copyMakeBorder(resized, top, self.imgsz - new_h - top, left, self.imgsz - new_w - left,
+                               cv2.BORDER_CONSTANT, dst=staging[i].numpy(), value=(114, 114, 114))
+            crops.append((top, left, new_h, new_w))
+
+        gpu = staging.to(self.device, non_blocking=True)
+        # NHWC uint8 BGR -> NCHW float RGB, normalized on the device.
+        # Kept in channels_last layout to match the model weights.
+        tensor = gpu.permute(0, 3, 1, 2).flip(1).float().div_(255).contiguous(memory_format=torch.channels_last)
+        return tensor, crops
+
+    def _extract(self, result, orig_shape, crop=None):
+        """
+        Convert a single Ultralytics result into (masks, class_ids, scores).
+        Args:
+            result: Ultralytics Results object.
+            orig_shape: (h, w) of the source frame the masks are resized to.
+            crop: (top, left, h, w) of the frame inside the letterboxed input, as
+                recorded by _upload(); derived from the mask shape when None.
+        """
         if result.masks is None:
             return [], [], []
 
-        # Extract data
-        # masks.data is a torch tensor (N, H, W)
-        # We need to convert to list of numpy arrays
-        # Resize masks to original image size if they aren't already
-        
         masks_tensor = result.masks.data
         boxes = result.boxes
-        
-        masks = []
-        class_ids = []
-        scores = []
-
-        if masks_tensor is not None:
-            # Resize masks to original frame size if needed
-            # Ultralytics usually returns masks in input_shape (e.g. 640x640)
-            # We need to resize them to frame.shape
-            
-            # Convert to CPU numpy
-            masks_np = masks_tensor.cpu().numpy()
-            
-            for i, mask in enumerate(masks_np):
-                # Resize to original frame size
-                # Note: result.orig_shape is (h, w)
-                mask_resized = cv2.resize(mask, (result.orig_shape[1], result.orig_shape[0]))
-                
-                # Binarize
-                mask_binary = (mask_resized > 0.5).astype(np.uint8)
-                
-                masks.append(mask_binary)
-                class_ids.append(int(boxes.cls[i].item()))
-                scores.append(float(boxes.conf[i].item()))
-
-        return masks, class_ids, scores
+
+        if masks_tensor is None:
+            return [], [], []
+
+        # Drop low-confidence and non-target detections with two tensor ops
+        # so rejected masks are never resized or transferred.
+        keep = boxes.conf >= self.min_score
+        if self.target_ids is not None:
+            keep &= torch.isin(boxes.cls.long(), self.target_ids)
+        masks_tensor = masks_tensor[keep]
+        cls = boxes.cls[keep]
+        conf = boxes.conf[keep]
+
+        if masks_tensor.shape[0] == 0:
+            return [], [], []
+
+        # Ultralytics returns masks in the letterboxed network input shape (e.g. 640x640).
+        # Cut the padding off first so resizing back to the frame keeps its aspect ratio.
+        top, left, h, w = crop or self._letterbox_crop(masks_tensor.shape[1:], orig_shape)
+        masks_tensor = masks_tensor[:, top:top + h, left:left + w]
+        if masks_tensor.is_cuda:
+            # Resize and binarize on the device so only uint8 masks are copied back.
+            masks_resized = F.interpolate(masks_tensor.unsqueeze(1).float(), size=tuple(orig_shape),
+                                          mode='bilinear', align_corners=False).squeeze(1)
+            masks_binary = (masks_resized > 0.5).to(torch.uint8).cpu().numpy()
+        else:
+            masks_binary = self._resize_masks_cpu(masks_tensor.numpy(), orig_shape)
+
+        # One transfer per field instead of a device sync per detection
+        class_ids = [int(c) for c in cls.cpu().tolist()]
+        scores = conf.cpu().tolist()
+
+        return list(masks_binary), class_ids, scores
+
+    @staticmethod
+    def _letterbox_crop(input_shape, orig_shape):
+        """
+        (top, left, h, w) of a frame of orig_shape letterboxed into input_shape.
+        """
+        in_h, in_w = input_shape
+        scale = min(in_h / orig_shape[0], in_w / orig_shape[1])
+        h, w = round(orig_shape[0] * scale), round(orig_shape[1] * scale)
+        return (in_h - h) // 2, (in_w - w) // 2, h, w
+
+    @staticmethod
+    def _resize_masks_cpu(masks_np, orig_shape):
+        """
+        Resize an (N, H, W) float mask stack with a single cv2.resize call by
+        treating it as one N-channel image, then binarize in one pass.
+        """
+        h, w = orig_shape
+        n = masks_np.shape[0]
+        stacked = np.ascontiguousarray(masks_np.transpose(1, 2, 0))
+        resized = cv2.resize(stacked, (w, h), interpolation=cv2.INTER_LINEAR)
+        # cv2 drops the channel axis for single-channel input
+        resized = resized.reshape(h, w, n).transpose(2, 0, 1)
+        # Contiguous so each per-detection slice can go straight to cv2.findContours
+        return np.ascontiguousarray(resized > 0.5).view(np.uint8)
 
     def mock_inference(self, shape):
         """
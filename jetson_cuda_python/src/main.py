@@ -4,6 +4,8 @@ import sys
 import argparse
 import os
 import cv2
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from .utils import load_config, setup_logger, mask_to_polygon, format_yolo_label
 from .camera_manager import CameraManager
 from .dataset_writer import DatasetWriter
@@ -38,14 +40,66 @@ class DataCollectorJetson:
             self.class_names = self.inference_engine.model.names
             
         self.target_classes = set(self.config['collection'].get('target_classes', []))
+
+        # Resolve class names once so the per-detection path is a list index
+        # and an int set lookup instead of dict/list dispatch on strings.
+        self._id_to_name = self._build_id_to_name(self.class_names)
+        self._target_ids = None
+        if self.target_classes:
+            self._target_ids = {i for i, name in enumerate(self._id_to_name) if name in self.target_classes}
+
         self.min_confidence = self.config['collection'].get('min_confidence', 0.6)
+        # Apply the same filter on the GPU so rejected detections never leave the device
+        self.inference_engine.set_filter(self.min_confidence, self._target_ids)
         
         self.capture_interval = self.config['collection'].get('interval_seconds', 5.0)
         self.last_capture_times = {} 
+        # Motion is only checked on every Kth due frame of each camera; the frames
+        # in between reuse the last verdict
+        self.motion_check_every = max(1, self.config.get('motion_detection', {}).get('check_every', 3))
+        self.frame_counts = {}
+        self.motion_verdicts = {}
+        # How long to wait for other cameras after the first frame arrives (seconds)
+        self.batch_window = self.config['collection'].get('batch_window_ms', 5) / 1000.0
+
+        # Disk writes run on a small pool; samples are dropped when it falls behind
+        self._io_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="DatasetIO")
+        self._io_slots = threading.Semaphore(self.config['storage'].get('max_pending_writes', 8))
 
         signal.signal(signal.SIGINT, self.shutdown)
         signal.signal(signal.SIGTERM, self.shutdown)
 
+    @staticmethod
+    def _build_id_to_name(class_names):
+        """
+        Flatten a class-name list or {id: name} dict into a dense list indexed by class id.
+        """
+        if isinstance(class_names, dict):
+            if not class_names:
+                return []
+            return [class_names.get(i, str(i)) for i in range(max(class_names) + 1)]
+        return list(class_names)
+
+    def class_name(self, cls_id):
+        """
+        Class name for an id, falling back to the id itself if unknown.
+        """
+        if cls_id < len(self._id_to_name):
+            return self._id_to_name[cls_id]
+        return str(cls_id)
+
+    def has_motion(self, cam_id, frame):
+        """
+        Motion verdict for a due frame. The detector runs on every Kth frame of
+        each camera and the frames in between reuse its last verdict. With motion
+        detection disabled check_motion() is always True, so every frame proceeds.
+        """
+        count = self.frame_counts.get(cam_id, 0)
+        self.frame_counts[cam_id] = count + 1
+        if count % self.motion_check_every == 0 or cam_id not in self.motion_verdicts:
+            self.motion_verdicts[cam_id] = self.camera_manager.check_motion(cam_id, frame)
+        return self.motion_verdicts[cam_id]
+
     def shutdown(self, signum, frame):
         """
         Signal handler for graceful shutdown.
@@ -66,64 +120,90 @@ class DataCollectorJetson:
         
         try:
             while self.running:
-                frames = self.camera_manager.get_frames()
+                # Sleep until a camera publishes, coalescing near-simultaneous arrivals
+                ready = self.camera_manager.wait_for_frames(timeout=1.0, window=self.batch_window)
                 current_time = time.time()
                 
-                for cam_id, frame in frames.items():
+                # Collect every frame due for capture this tick into one batch
+                due_items = []
+                for cam_id in ready:
                     last_time = self.last_capture_times.get(cam_id, 0)
                     if current_time - last_time < self.capture_interval:
                         continue
+
+                    frame = self.camera_manager.get_frame(cam_id)
+                    if frame is None:
+                        continue
                     
                     # Check for motion if configured
-                    if not self.camera_manager.check_motion(cam_id, frame):
+                    if not self.has_motion(cam_id, frame):
                         # No motion detected, skip inference to save resources
                         continue
-                        
-                    # Inference
-                    results = self.inference_engine.infer(frame)
-                    if not results:
-                        continue
-                        
-                    masks, class_ids, scores = results
-                    
-                    yolo_annotations = []
-                    classes_detected = []
-                    
-                    for mask, cls_id, score in zip(masks, class_ids, scores):
-                        if score < self.min_confidence:
-                            continue
-                            
-                        # Handle class names map
-                        if isinstance(self.class_names, dict):
-                             class_name = self.class_names.get(cls_id, str(cls_id))
-                        elif cls_id < len(self.class_names):
-                            class_name = self.class_names[cls_id]
-                        else:
-                            class_name = str(cls_id)
-                        
-                        if self.target_classes and class_name not in self.target_classes:
-                            continue
-                            
-                        polygons = mask_to_polygon(mask)
-                        if not polygons:
-                            continue
-                            
-                        lines = format_yolo_label(cls_id, polygons)
-                        yolo_annotations.extend(lines)
-                        classes_detected.append(class_name)
-                    
-                    if yolo_annotations:
-                        self.dataset_writer.save_sample(frame, cam_id, yolo_annotations, classes_detected)
-                        self.last_capture_times[cam_id] = current_time
-                        logger.info(f"Captured sample from {cam_id}: {len(yolo_annotations)} objects")
-                
-                time.sleep(0.01) # Faster poll on Jetson
+
+                    # get_frame() already returned our own copy, so the batch and the
+                    # writer can keep it while the capture thread recycles its slots
+                    due_items.append((cam_id, frame))
+
+                if due_items:
+                    # Inference (single batched forward pass for all cameras)
+                    cam_ids, batch = zip(*due_items)
+                    batch_results = self.inference_engine.infer_batch(list(batch))
+
+                    for cam_id, frame, results in zip(cam_ids, batch, batch_results):
+                        self.process_results(cam_id, frame, results, current_time)
                 
         except Exception as e:
             logger.error(f"Runtime error: {e}", exc_info=True)
         finally:
             self.cleanup()
 
+    def process_results(self, cam_id, frame, results, current_time):
+        """
+        Filter detections for one camera and save the sample if anything remains.
+        """
+        if not results:
+            return
+            
+        masks, class_ids, scores = results
+        
+        yolo_annotations = []
+        classes_detected = []
+        
+        for mask, cls_id, score in zip(masks, class_ids, scores):
+            if score < self.min_confidence:
+                continue
+
+            if self._target_ids is not None and cls_id not in self._target_ids:
+                continue
+                
+            polygons = mask_to_polygon(mask)
+            if not polygons:
+                continue
+                
+            lines = format_yolo_label(cls_id, polygons)
+            yolo_annotations.extend(lines)
+            classes_detected.append(self.class_name(cls_id))
+        
+        if yolo_annotations:
+            if not self._io_slots.acquire(blocking=False):
+                logger.warning(f"Writer backlog full, dropping sample from {cam_id}")
+                return
+            # frame is already our own copy, safe to hand to the worker
+            self._io_pool.submit(self._save_and_release, frame, cam_id, yolo_annotations, classes_detected)
+            self.last_capture_times[cam_id] = current_time
+            logger.info(f"Captured sample from {cam_id}: {len(yolo_annotations)} objects")
+
+    def _save_and_release(self, frame, cam_id, yolo_annotations, classes_detected):
+        """
+        Worker-side save; frees the backlog slot even if the write fails.
+        """
+        try:
+            self.dataset_writer.save_sample(frame, cam_id, yolo_annotations, classes_detected)
+        except Exception as e:
+            logger.error(f"Failed to save sample from {cam_id}: {e}")
+        finally:
+            self._io_slots.release()
+
     def cleanup(self):
         """
         Stop services and release resources.
@@ -131,6 +211,8 @@ class DataCollectorJetson:
         logger.info("Cleaning up resources...")
         self.camera_manager.stop_all()
         self.inference_engine.stop()
+        # Flush samples still queued for disk
+        self._io_pool.shutdown(wait=True)
         logger.info("Shutdown complete.")
 
 def main():
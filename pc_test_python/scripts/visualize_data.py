@@ -2,10 +2,11 @@ import streamlit as st
 import pandas as pd
 import sqlite3
 import os
+import heapq
 import yaml
 import cv2
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageDraw
 
 def load_config(config_path):
     with open(config_path, 'r') as f:
@@ -14,6 +15,67 @@ def load_config(config_path):
 def get_db_connection(db_path):
     return sqlite3.connect(db_path)
 
+@st.cache_data(ttl=30)
+def load_split_counts(db_path, db_mtime):
+    """
+    Count frames per split inside SQLite. Cached per database mtime so reruns skip the query.
+    """
+    conn = get_db_connection(db_path)
+    try:
+        return dict(conn.execute("SELECT split, COUNT(*) FROM frames GROUP BY split").fetchall())
+    finally:
+        conn.close()
+
+@st.cache_data(ttl=30)
+def load_frames(db_path, db_mtime, limit=1000):
+    """
+    Load the most recent rows of the frames table. Cached per database mtime.
+    """
+    conn = get_db_connection(db_path)
+    try:
+        return pd.read_sql_query("SELECT * FROM frames ORDER BY timestamp DESC LIMIT ?", conn, params=(limit,))
+    finally:
+        conn.close()
+
+# Gallery tiles are a quarter of the page wide, so full-resolution frames are wasted bytes
+THUMB_WIDTH = 512
+
+@st.cache_data(max_entries=256)
+def load_annotated(img_path, lbl_path, mtimes, class_names):
+    """
+    Read an image, downscale it to a thumbnail and draw its labels, returning
+    JPEG bytes (or None). Cached on the file mtimes so edits to the image or
+    label invalidate it.
+    """
+    img = cv2.imread(img_path)
+    if img is None:
+        return None
+    # Labels are normalized, so they can be drawn straight onto the thumbnail
+    h, w = img.shape[:2]
+    if w > THUMB_WIDTH:
+        img = cv2.resize(img, (THUMB_WIDTH, int(THUMB_WIDTH * h / w)), interpolation=cv2.INTER_AREA)
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    img = draw_yolo_labels(img, lbl_path, class_names)
+    # Encode once here so Streamlit serves the bytes without its own PIL round-trip
+    ok, buf = cv2.imencode('.jpg', cv2.cvtColor(img, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 80])
+    return buf.tobytes() if ok else None
+
+@st.cache_data(max_entries=8)
+def list_images(dir_path, dir_mtime, limit):
+    """
+    The first `limit` image file names of a directory in sorted order.
+    Uses a bounded heap instead of sorting every name. Cached per directory
+    mtime, which changes whenever a file is added or removed.
+    """
+    with os.scandir(dir_path) as entries:
+        return heapq.nsmallest(limit, (e.name for e in entries if e.name.endswith(('.jpg', '.png'))))
+
+def file_mtime(path):
+    return os.path.getmtime(path) if os.path.exists(path) else 0.0
+
+# Simple color cycle based on class_id
+LABEL_COLORS = [(0, 255, 0), (255, 0, 0), (0, 0, 255), (255, 255, 0), (0, 255, 255)]
+
 def draw_yolo_labels(image, label_path, class_names):
     """
     Draw YOLO segmentation polygons or boxes on the image.
@@ -23,47 +85,54 @@ def draw_yolo_labels(image, label_path, class_names):
 
     img_h, img_w = image.shape[:2]
     
+    # Read the file once and parse each row in C instead of per-token float()
     with open(label_path, 'r') as f:
-        lines = f.readlines()
+        raw = f.read()
+    rows = [np.fromstring(l, sep=' ', dtype=np.float32) for l in raw.splitlines() if l.strip()]
 
     # Create a copy to draw on
     img_draw = image.copy()
+    # Denormalization factors for (x, y) pairs
+    scale = np.array([img_w, img_h], dtype=np.float32)
 
-    for line in lines:
-        parts = line.strip().split()
-        if not parts:
-            continue
-            
-        class_id = int(parts[0])
-        coords = list(map(float, parts[1:]))
-        
-        color = (0, 255, 0) # Green default
-        # Simple color cycle based on class_id
-        colors = [(0, 255, 0), (255, 0, 0), (0, 0, 255), (255, 255, 0), (0, 255, 255)]
-        color = colors[class_id % len(colors)]
-
+    def label_style(class_id):
+        color = LABEL_COLORS[class_id % len(LABEL_COLORS)]
         class_name = class_names[class_id] if class_id < len(class_names) else str(class_id)
-
-        if len(coords) == 4:
-            # Bounding Box (cx, cy, w, h)
-            cx, cy, w, h = coords
-            x1 = int((cx - w/2) * img_w)
-            y1 = int((cy - h/2) * img_h)
-            x2 = int((cx + w/2) * img_w)
-            y2 = int((cy + h/2) * img_h)
+        return color, class_name
+
+    # Bounding Boxes (cls, cx, cy, w, h): denormalize all rows at once
+    boxes = [r for r in rows if r.size == 5]
+    if boxes:
+        boxes = np.stack(boxes)
+        class_ids = boxes[:, 0].astype(int)
+        centers, sizes = boxes[:, 1:3], boxes[:, 3:5]
+        top_left = ((centers - sizes / 2) * scale).astype(np.int32)
+        bottom_right = ((centers + sizes / 2) * scale).astype(np.int32)
+
+        for class_id, (x1, y1), (x2, y2) in zip(class_ids.tolist(), top_left.tolist(), bottom_right.tolist()):
+            color, class_name = label_style(class_id)
             cv2.rectangle(img_draw, (x1, y1), (x2, y2), color, 2)
             cv2.putText(img_draw, class_name, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-            
-        elif len(coords) > 4:
-            # Polygon
-            # Reshape to (-1, 2)
-            points = np.array(coords).reshape(-1, 2)
-            # Denormalize
-            points[:, 0] *= img_w
-            points[:, 1] *= img_h
-            points = points.astype(np.int32)
-            
-            cv2.polylines(img_draw, [points], isClosed=True, color=color, thickness=2)
+
+    # Polygons (cls, x1, y1, x2, y2, ...)
+    polygons = []
+    for row in rows:
+        if row.size <= 5:
+            continue
+        color, class_name = label_style(int(row[0]))
+        # Reshape to (-1, 2) and denormalize x and y in one multiply
+        points = (row[1:].reshape(-1, 2) * scale).astype(np.int32)
+        polygons.append((color, class_name, points.tolist()))
+
+    if polygons:
+        # Rasterize all outlines with PIL's scanline drawer, keep cv2 for text only
+        pil_img = Image.fromarray(img_draw)
+        draw = ImageDraw.Draw(pil_img)
+        for color, _, points in polygons:
+            draw.polygon([tuple(p) for p in points], outline=color, width=2)
+        img_draw = np.array(pil_img)
+
+        for color, class_name, points in polygons:
             # Put text at the first point
             cv2.putText(img_draw, class_name, tuple(points[0]), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
 
@@ -103,17 +172,19 @@ def main():
         st.header("Collection Statistics")
         
         # Load data
-        df = pd.read_sql_query("SELECT * FROM frames", conn)
+        # The writer uses WAL mode, so new rows land in the -wal file first
+        db_mtime = (file_mtime(db_path), file_mtime(db_path + '-wal'))
+        counts = load_split_counts(db_path, db_mtime)
         
         col1, col2, col3 = st.columns(3)
-        col1.metric("Total Frames", len(df))
-        col2.metric("Training Samples", len(df[df['split'] == 'train']))
-        col3.metric("Validation Samples", len(df[df['split'] == 'val']))
+        col1.metric("Total Frames", sum(counts.values()))
+        col2.metric("Training Samples", counts.get('train', 0))
+        col3.metric("Validation Samples", counts.get('val', 0))
         
         st.subheader("Objects per Class")
         # This is a bit complex because 'classes' is a string representation of a list
-        # simplified check
-        st.dataframe(df)
+        # simplified check: show the most recent frames only
+        st.dataframe(load_frames(db_path, db_mtime))
 
     elif mode == "Gallery":
         st.header("Image Gallery")
@@ -129,19 +200,23 @@ def main():
             st.warning(f"No directory found: {split_img_dir}")
             return
 
-        image_files = sorted([f for f in os.listdir(split_img_dir) if f.endswith(('.jpg', '.png'))])
-        
-        if not image_files:
-            st.info("No images found in this split.")
-            return
-
         # Pagination
         page_size = 8
         page_number = st.sidebar.number_input("Page", min_value=1, value=1)
         start_idx = (page_number - 1) * page_size
         end_idx = start_idx + page_size
         
+        # Only the names up to the current page are needed
+        image_files = list_images(split_img_dir, os.stat(split_img_dir).st_mtime_ns, end_idx)
+        
+        if not image_files:
+            st.info("No images found in this split.")
+            return
+        
         current_batch = image_files[start_idx:end_idx]
+        if not current_batch:
+            st.info("No images on this page.")
+            return
         
         cols = st.columns(4)
         for i, img_file in enumerate(current_batch):
@@ -149,13 +224,11 @@ def main():
             lbl_file = os.path.splitext(img_file)[0] + ".txt"
             lbl_path = os.path.join(split_lbl_dir, lbl_file)
             
-            # Load and draw
-            img = cv2.imread(img_path)
-            if img is None:
+            # Load and draw (memoized across reruns)
+            mtimes = (file_mtime(img_path), file_mtime(lbl_path))
+            img_annotated = load_annotated(img_path, lbl_path, mtimes, tuple(class_names))
+            if img_annotated is None:
                 continue
-                
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            img_annotated = draw_yolo_labels(img, lbl_path, class_names)
             
             with cols[i % 4]:
                 st.image(img_annotated, caption=img_file, use_container_width=True)
@@ -1,3 +1,4 @@
+import os
 import cv2
 import time
 import threading
@@ -5,23 +6,51 @@ import numpy as np
 import logging
 from queue import Queue, Empty
 
+try:
+    from multiprocessing import shared_memory
+    SHARED_MEMORY_AVAILABLE = True
+except ImportError:
+    SHARED_MEMORY_AVAILABLE = False
+
+from .utils import pin_current_thread
+
 logger = logging.getLogger("CameraManager")
 
+# Bytes reserved at the start of a frame ring for the publish counter (keeps frames cache-line aligned)
+RING_HEADER = 64
+
 class MotionDetector:
     """
     Simple motion detector using frame differencing.
     """
-    def __init__(self, threshold=25, min_area=500):
+    def __init__(self, threshold=25, min_area=500, scale=0.25):
         self.threshold = threshold
         self.min_area = min_area
+        # Motion is coarse, so difference a downscaled frame
+        self.scale = scale
+        # min_area is given in full-resolution pixels
+        self.scaled_min_area = min_area * scale * scale
         self.prev_frame = None
 
-    def detect(self, frame):
+    def preprocess(self, frame):
         """
-        Check if motion is detected in the frame compared to the previous frame.
+        Downscale, grayscale and blur a BGR frame into the image that is differenced.
         """
+        if self.scale != 1.0:
+            frame = cv2.resize(frame, (0, 0), fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (21, 21), 0)
+        # INTER_AREA already averages pixels, so a small kernel is enough after downscaling
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def detect(self, frame, gray=None):
+        """
+        Check if motion is detected in the frame compared to the previous frame.
+        Args:
+            frame: BGR frame.
+            gray: Optional output of preprocess(frame), computed here if not given.
+        """
+        if gray is None:
+            gray = self.preprocess(frame)
 
         if self.prev_frame is None:
             self.prev_frame = gray
@@ -34,38 +63,66 @@ class MotionDetector:
         # Dilate to fill in holes
         thresh = cv2.dilate(thresh, None, iterations=2)
         
-        # Find contours
-        contours, _ = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        detected = False
-        for c in contours:
-            if cv2.contourArea(c) > self.min_area:
-                detected = True
-                break
-                
         self.prev_frame = gray
-        return detected
+        
+        # No blob can exceed min_area if fewer pixels than that changed in total
+        if cv2.countNonZero(thresh) <= self.scaled_min_area:
+            return False
+        
+        # Area of every blob in one pass (label 0 is the background)
+        _, _, stats, _ = cv2.connectedComponentsWithStats(thresh, connectivity=8, ltype=cv2.CV_32S)
+        return bool(stats[1:, cv2.CC_STAT_AREA].max() > self.scaled_min_area)
 
 class CameraStream:
     """
     Manages a single camera RTSP stream in a separate thread.
     Handles auto-reconnection and buffering.
     """
-    def __init__(self, camera_config, motion_config=None):
+    def __init__(self, camera_config, motion_config=None, frame_event=None):
         """
         Initialize the camera stream.
         Args:
             camera_config: Dictionary containing camera ID, URL, and name.
             motion_config: Optional dictionary for motion detection settings.
+            frame_event: Optional threading.Event set whenever a new frame is published.
         """
         self.id = camera_config['id']
-        self.url = camera_config['url']
+        # A lower-resolution substream, when the camera offers one, replaces the main stream
+        self.url = camera_config.get('substream_url') or camera_config['url']
         self.name = camera_config.get('name', self.id)
+        # RTSP streams are opened through a low-latency GStreamer pipeline when available
+        self.gstreamer = camera_config.get('gstreamer', True)
+        self.codec = camera_config.get('codec', 'h264')
+        # GStreamer decoder element. decodebin picks the highest-ranked decoder installed,
+        # i.e. the V4L2 hardware decoder (v4l2h264dec / v4l2slh265dec) when the board has
+        # one and avdec_* otherwise. Set e.g. "v4l2h264dec" to force a specific element.
+        self.decoder = camera_config.get('decoder', 'decodebin')
+        # Optional [width, height] the GStreamer pipeline scales frames to right after decoding
+        self.decode_resolution = camera_config.get('decode_resolution')
+        # Optional CPU core for the capture thread (decoder threads it spawns inherit it)
+        self.cpu_core = camera_config.get('cpu_core')
         self.reconnect_interval = 5
         self.running = False
         self.thread = None
-        self.lock = threading.Lock()
-        self.latest_frame = None
+        # Single-producer/single-consumer ring of preallocated frames. The capture
+        # thread fills slot seq % ring_size, then publishes it by storing seq + 1
+        # in the aligned uint64 counter (a single atomic store); no lock is taken.
+        # A slot is only rewritten ring_size - 1 publishes after it was published.
+        self.ring_size = max(3, camera_config.get('ring_size', 3))
+        self._shm = None
+        # Segments that could not be closed yet because a reader still holds a frame view
+        self._retired_shm = []
+        # The ring is one (generation, seq counter, slots, grays) tuple, replaced with a
+        # single assignment when the resolution changes. Readers take a local snapshot,
+        # so a sequence number is always paired with the slots it belongs to. grays holds
+        # the motion-detector view of each slot, converted once by the capture thread.
+        self._ring = (0, np.zeros(1, dtype=np.uint64), [], [])
+        # (generation, seq) seen by the last get_frame() call, and the (copy, gray) it returned
+        self._last_read = (0, 0)
+        self._last_copy = (None, None)
+        self.frame_event = frame_event
+        # time.monotonic() before which frames are only grabbed, not converted or published
+        self.retrieve_after = 0.0
         self.last_access_time = 0
         self.connected = False
         
@@ -74,7 +131,8 @@ class CameraStream:
         if motion_config and motion_config.get('enabled', False):
             self.motion_detector = MotionDetector(
                 threshold=motion_config.get('threshold', 25),
-                min_area=motion_config.get('min_area', 500)
+                min_area=motion_config.get('min_area', 500),
+                scale=motion_config.get('scale', 0.25)
             )
         
     def start(self):
@@ -95,22 +153,135 @@ class CameraStream:
         self.running = False
         if self.thread:
             self.thread.join()
+        self._release_ring()
         logger.info(f"Camera {self.name} ({self.id}) stopped.")
 
+    def _allocate_ring(self, shape):
+        """
+        (Re)create the frame ring for the given frame shape. The ring lives in
+        shared memory when available so another process can attach to it later.
+        The new ring is fully built before it replaces the old one, and its
+        counter starts at 0, so readers never index it with a stale sequence.
+        """
+        frame_bytes = int(np.prod(shape))
+        shm = None
+        if SHARED_MEMORY_AVAILABLE:
+            shm = shared_memory.SharedMemory(create=True, size=RING_HEADER + self.ring_size * frame_bytes)
+            seq = np.ndarray((1,), dtype=np.uint64, buffer=shm.buf)
+            ring = np.ndarray((self.ring_size, *shape), dtype=np.uint8, buffer=shm.buf, offset=RING_HEADER)
+        else:
+            seq = np.zeros(1, dtype=np.uint64)
+            ring = np.empty((self.ring_size, *shape), dtype=np.uint8)
+        seq[0] = 0
+        new_ring = (self._ring[0] + 1, seq, list(ring), [None] * self.ring_size)
+        old_shm, self._shm = self._shm, shm
+        self._ring = new_ring
+        self._retire_shm(old_shm)
+
+    def _release_ring(self):
+        """
+        Drop our views of the ring and unlink its shared-memory segment.
+        """
+        self._ring = (self._ring[0] + 1, np.zeros(1, dtype=np.uint64), [], [])
+        old_shm, self._shm = self._shm, None
+        self._retire_shm(old_shm)
+
+    def _retire_shm(self, shm):
+        """
+        Unlink a replaced ring segment, closing it unless a reader still holds a frame from it.
+        """
+        if shm is None:
+            return
+        shm.unlink()
+        try:
+            shm.close()
+        except BufferError:
+            # A caller still holds a frame; keep the mapping alive until exit
+            self._retired_shm.append(shm)
+
+    def _next_slot(self, shape):
+        """
+        Return (seq, slot) for the next frame to write, allocating the ring on
+        the first frame or when the resolution changes.
+        """
+        _, seq_counter, slots, _ = self._ring
+        if not slots or slots[0].shape != shape:
+            self._allocate_ring(shape)
+            _, seq_counter, slots, _ = self._ring
+        seq = int(seq_counter[0])
+        return seq, slots[seq % self.ring_size]
+
+    def _publish(self, seq, slot):
+        """
+        Make the slot the latest frame, together with its grayscale view.
+        """
+        _, seq_counter, _, grays = self._ring
+        if self.motion_detector:
+            grays[seq % self.ring_size] = self.motion_detector.preprocess(slot)
+        seq_counter[0] = seq + 1
+        # Wake the main loop
+        if self.frame_event is not None:
+            self.frame_event.set()
+
+    def _gst_pipeline(self):
+        """
+        Build a GStreamer pipeline that keeps no latency buffer and hands
+        only the newest decoded frame to OpenCV.
+        """
+        depay = 'rtph265depay ! h265parse' if self.codec == 'h265' else 'rtph264depay ! h264parse'
+        # Scale before the colour conversion so BGR conversion and the copy to
+        # OpenCV only ever touch the smaller frame
+        scale = ''
+        if self.decode_resolution:
+            width, height = self.decode_resolution
+            scale = f"videoscale ! video/x-raw,width={width},height={height} ! "
+        return (
+            f"rtspsrc location={self.url} latency=0 drop-on-latency=true ! {depay} ! {self.decoder} ! "
+            f"{scale}videoconvert ! video/x-raw,format=BGR ! appsink drop=true max-buffers=1 sync=false"
+        )
+
+    def _open_capture(self, url_to_open):
+        """
+        Open the capture device, preferring GStreamer for RTSP streams.
+        Falls back to the FFMPEG backend if GStreamer is unavailable.
+        """
+        if self.gstreamer and isinstance(url_to_open, str) and url_to_open.startswith('rtsp://'):
+            cap = cv2.VideoCapture(self._gst_pipeline(), cv2.CAP_GSTREAMER)
+            if cap.isOpened():
+                return cap
+            logger.warning(f"Camera {self.name}: GStreamer pipeline unavailable, using FFMPEG backend.")
+            cap.release()
+
+        if isinstance(url_to_open, int):
+            # Webcam index: let OpenCV pick the native backend
+            cap = cv2.VideoCapture(url_to_open)
+        else:
+            # Low-latency RTSP: TCP transport and no demuxer buffering (user overrides win)
+            os.environ.setdefault('OPENCV_FFMPEG_CAPTURE_OPTIONS', 'rtsp_transport;tcp|fflags;nobuffer')
+            cap = cv2.VideoCapture(url_to_open, cv2.CAP_FFMPEG)
+        # Keep at most one decoded frame queued so we always read the newest one
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
     def _update(self):
         """
         Internal loop to read frames from the camera.
         Handles reconnection logic on failure.
         """
+        if self.cpu_core is not None and not pin_current_thread(self.cpu_core):
+            logger.warning(f"Camera {self.name}: could not pin capture thread to core {self.cpu_core}")
+        
         if self.url == "test":
             # Mock mode logic
             while self.running:
-                # Generate dummy frame
-                frame = np.zeros((640, 640, 3), dtype=np.uint8)
-                cv2.randu(frame, 0, 255)
-                with self.lock:
-                    self.latest_frame = frame
-                    self.connected = True
+                if time.monotonic() < self.retrieve_after:
+                    time.sleep(1/15)
+                    continue
+                # Generate dummy frame straight into the next ring slot
+                seq, slot = self._next_slot((640, 640, 3))
+                cv2.randu(slot, 0, 255)
+                self._publish(seq, slot)
+                self.connected = True
                 time.sleep(1/15) # 15 FPS
             return
 
@@ -119,29 +290,45 @@ class CameraStream:
         if isinstance(self.url, str) and self.url.isdigit():
             url_to_open = int(self.url)
 
-        cap = cv2.VideoCapture(url_to_open)
+        cap = self._open_capture(url_to_open)
         while self.running:
             if not cap.isOpened():
                 self.connected = False
                 logger.warning(f"Camera {self.name} disconnected. Retrying in {self.reconnect_interval}s...")
                 time.sleep(self.reconnect_interval)
-                cap = cv2.VideoCapture(url_to_open)
+                cap = self._open_capture(url_to_open)
                 continue
             
             self.connected = True
-            ret, frame = cap.read()
+            # grab() keeps the stream at its live position (H.264/H.265 must decode every
+            # packet); the BGR conversion, ring copy and motion preprocessing happen only
+            # for frames retrieved while the main loop wants this camera
+            ret = cap.grab()
+            if ret and time.monotonic() < self.retrieve_after:
+                continue
+            
+            # Decode straight into the next ring slot instead of a fresh array.
+            # retrieve() only allocates if the slot does not match the stream resolution.
+            _, seq_counter, slots, _ = self._ring
+            slot = slots[int(seq_counter[0]) % self.ring_size] if slots else None
+            if ret:
+                ret, frame = cap.retrieve(slot)
             
             if not ret:
                 self.connected = False
                 logger.warning(f"Camera {self.name} failed to read frame. Reconnecting...")
                 cap.release()
                 time.sleep(self.reconnect_interval)
-                cap = cv2.VideoCapture(url_to_open)
+                cap = self._open_capture(url_to_open)
                 continue
             
-            # Store latest frame safely
-            with self.lock:
-                self.latest_frame = frame.copy()
+            if frame is not slot:
+                # First frame or new resolution: (re)build the ring and copy into it
+                seq, slot = self._next_slot(frame.shape)
+                np.copyto(slot, frame)
+            else:
+                seq = int(seq_counter[0])
+            self._publish(seq, slot)
             
             # Optional: Sleep to limit capture FPS if needed to save CPU, 
             # but usually we want to clear the buffer so we read as fast as possible 
@@ -152,14 +339,38 @@ class CameraStream:
 
     def get_frame(self):
         """
-        Retrieve the latest captured frame.
+        Return a private copy of the latest captured frame.
+        The copy is validated against the publish counter: if the capture thread
+        may have started rewriting the slot while it was copied, it is retried
+        with the newer frame, so callers never see a torn frame.
         Returns:
-            numpy array or None if no frame available.
+            numpy array or None if no new frame arrived since the previous call.
         """
-        with self.lock:
-            if self.latest_frame is None:
+        while True:
+            generation, seq_counter, slots, grays = self._ring
+            seq = int(seq_counter[0])
+            if seq == 0 or (generation, seq) == self._last_read:
                 return None
-            return self.latest_frame.copy()
+            index = (seq - 1) % self.ring_size
+            gray = grays[index]
+            frame = slots[index].copy()
+            # The slot of frame seq is rewritten once the counter reaches seq + ring_size - 1
+            if int(seq_counter[0]) - seq < self.ring_size - 1:
+                self._last_read = (generation, seq)
+                self._last_copy = (frame, gray)
+                return frame
+
+    def get_gray_frame(self):
+        """
+        Retrieve the motion detector's grayscale view of the latest frame.
+        Returns:
+            numpy array or None if motion detection is disabled or no frame is available.
+        """
+        _, seq_counter, _, grays = self._ring
+        seq = int(seq_counter[0])
+        if seq == 0:
+            return None
+        return grays[(seq - 1) % self.ring_size]
 
     def check_motion(self, frame):
         """
@@ -167,7 +378,9 @@ class CameraStream:
         Uses the internal MotionDetector state.
         """
         if self.motion_detector:
-            return self.motion_detector.detect(frame)
+            # Reuse the capture thread's conversion if this is the copy get_frame() returned
+            last_frame, gray = self._last_copy
+            return self.motion_detector.detect(frame, gray if frame is last_frame else None)
         return True # If motion detection is disabled, always return True
 
 class CameraManager:
@@ -182,11 +395,17 @@ class CameraManager:
         """
         self.cameras = {}
         motion_config = config.get('motion_detection', {})
+        # Set by any camera when it publishes a frame
+        self.frame_event = threading.Event()
         
         for cam_conf in config['cameras']:
             if cam_conf.get('enabled', True):
-                cam = CameraStream(cam_conf, motion_config)
+                cam = CameraStream(cam_conf, motion_config, self.frame_event)
                 self.cameras[cam.id] = cam
+        
+        # Reused by get_frames(): one entry per camera, refreshed in place every call
+        self._cam_items = tuple(self.cameras.items())
+        self._frames = dict.fromkeys(self.cameras)
     
     def start_all(self):
         """
@@ -210,15 +429,34 @@ class CameraManager:
             return self.cameras[camera_id].check_motion(frame)
         return True
 
+    def defer_frames(self, camera_id, until):
+        """
+        Let a camera skip converting and publishing frames until the given
+        time.monotonic() deadline. The stream is still read so it stays live.
+        """
+        if camera_id in self.cameras:
+            self.cameras[camera_id].retrieve_after = until
+
+    def wait_for_frames(self, timeout=None):
+        """
+        Block until any camera publishes a new frame, or until timeout seconds pass.
+        Returns:
+            True if a new frame arrived.
+        """
+        arrived = self.frame_event.wait(timeout)
+        # Clear before the caller reads frames, so a frame published after this
+        # point sets the event again for the next wait
+        self.frame_event.clear()
+        return arrived
+
     def get_frames(self):
         """
-        Get the latest frame from all active cameras.
+        Get the frames published since the previous call from all active cameras.
+        The same dict is refreshed on every call, so consume it before calling again.
         Returns:
-            Dict {camera_id: frame}
+            Dict {camera_id: frame}, with None for cameras that have no new frame.
         """
-        frames = {}
-        for cam_id, cam in self.cameras.items():
-            frame = cam.get_frame()
-            if frame is not None:
-                frames[cam_id] = frame
+        frames = self._frames
+        for cam_id, cam in self._cam_items:
+            frames[cam_id] = cam.get_frame()
         return frames
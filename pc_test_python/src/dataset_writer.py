@@ -2,11 +2,13 @@ import os
 import cv2
 import time
 import uuid
-import random
+import hashlib
 import sqlite3
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from .utils import ensure_directories
+from .utils import ensure_directories, pin_current_thread
 
 logger = logging.getLogger("DatasetWriter")
 
@@ -28,10 +30,40 @@ class DatasetWriter:
         self.images_dir = self.config['images_dir']
         self.labels_dir = self.config['labels_dir']
         self.db_path = os.path.join(self.base_path, self.config.get('database_path', 'datacollector.db'))
+        # Rows are buffered and inserted in one transaction every N rows or T seconds
+        self.db_batch_size = self.config.get('db_batch_size', 128)
+        self.db_flush_interval = self.config.get('db_flush_interval', 1.0)
+        self._db_rows = []
+        self._db_lock = threading.Lock()
+        self._db_wake = threading.Event()
+        self._db_stop = threading.Event()
+        # JPEG encode + disk writes run off the capture loop; libjpeg releases the GIL
+        self.jpeg_quality = self.config.get('jpeg_quality', 95)
+        # Workers start lazily on the first submit, from the (possibly pinned) main loop,
+        # so each one sets its own affinity: write_cpu_cores, or the process's startup set
+        self.write_cpu_cores = self.config.get('write_cpu_cores')
+        if self.write_cpu_cores is None and hasattr(os, 'sched_getaffinity'):
+            self.write_cpu_cores = os.sched_getaffinity(0)
+        self._io_pool = ThreadPoolExecutor(max_workers=self.config.get('write_workers', 2),
+                                           thread_name_prefix="DatasetWriter",
+                                           initializer=self._pin_worker)
+        # Bounds the samples queued or being written; beyond it new samples are dropped
+        # so a slow SD card cannot grow memory without limit
+        self._write_slots = threading.BoundedSemaphore(self.config.get('write_queue_size', 16))
         
         self.setup_directories()
         self.setup_database()
         
+        self._db_thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._db_thread.start()
+        
+    def _pin_worker(self):
+        """
+        Writer thread initializer: apply write_cpu_cores instead of the submitting thread's affinity.
+        """
+        if self.write_cpu_cores is not None and not pin_current_thread(self.write_cpu_cores):
+            logger.warning(f"Could not pin {threading.current_thread().name} to cores {self.write_cpu_cores}")
+
     def setup_directories(self):
         """
         Create necessary directory structure for YOLO format.
@@ -50,10 +82,15 @@ class DatasetWriter:
 
     def setup_database(self):
         """
-        Initialize the SQLite database schema.
+        Open the long-lived SQLite connection and initialize the schema.
         """
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        # Autocommit mode; batches are wrapped in explicit BEGIN/COMMIT
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        # WAL + NORMAL sync: one fsync per checkpoint instead of per commit
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('PRAGMA temp_store=MEMORY')
+        c = self.conn.cursor()
         c.execute('''
             CREATE TABLE IF NOT EXISTS frames (
                 id TEXT PRIMARY KEY,
@@ -66,27 +103,35 @@ class DatasetWriter:
                 classes TEXT
             )
         ''')
-        conn.commit()
-        conn.close()
+        # The viewer orders by timestamp and counts per split
+        c.execute('CREATE INDEX IF NOT EXISTS idx_frames_timestamp ON frames(timestamp DESC)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_frames_split ON frames(split)')
 
     def save_sample(self, frame, camera_id, annotations, classes_detected):
         """
-        Save a frame and its annotations to disk.
+        Queue a frame and its annotations to be saved to disk.
+        The frame is encoded on a worker thread, so it must not be modified after this call.
         Args:
             frame: Image numpy array.
             camera_id: Source camera identifier.
             annotations: List of YOLO formatted strings.
             classes_detected: List of class names present in the frame.
+        Returns:
+            True if the sample was queued, False if it was skipped or dropped.
         """
         if not annotations and not self.config.get('save_empty', False):
-            return
+            return False
+        
+        if not self._write_slots.acquire(blocking=False):
+            logger.warning(f"Write queue full, dropping sample from {camera_id}")
+            return False
 
         timestamp = time.time()
         # Generate unique ID based on camera, time, and UUID
         frame_id = f"{camera_id}_{int(timestamp * 1000)}_{str(uuid.uuid4())[:8]}"
         
-        # Determine split (train vs val)
-        split = 'train' if random.random() < self.train_split else 'val'
+        # Determine split (train vs val) from a hash of the frame id, so it is reproducible
+        split = 'train' if self.split_fraction(frame_id) < self.train_split else 'val'
         
         # Paths
         img_filename = f"{frame_id}.jpg"
@@ -98,30 +143,93 @@ class DatasetWriter:
         img_full_path = os.path.join(self.base_path, img_rel_path)
         lbl_full_path = os.path.join(self.base_path, lbl_rel_path)
         
-        # Save Image
-        cv2.imwrite(img_full_path, frame)
-        
-        # Save Label
-        with open(lbl_full_path, 'w') as f:
-            f.write('\n'.join(annotations))
+        db_row = (frame_id, camera_id, timestamp, split, img_rel_path, lbl_rel_path, len(annotations), str(classes_detected))
+        self._io_pool.submit(self._write_sample, frame, img_full_path, annotations, lbl_full_path, db_row)
+        return True
+
+    @staticmethod
+    def split_fraction(frame_id):
+        """
+        Map a frame id to a stable value in [0, 1) used to pick its split.
+        """
+        digest = hashlib.blake2b(frame_id.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'big') / 2**64
+
+    def _write_sample(self, frame, img_path, annotations, lbl_path, db_row):
+        """
+        Worker thread: encode and write the image, write the label, then log to DB.
+        """
+        try:
+            # Save Image
+            ok, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            if not ok:
+                logger.error(f"Failed to encode image {img_path}")
+                return
+            with open(img_path, 'wb') as f:
+                f.write(buf.tobytes())
             
-        # Log to DB
-        self.log_to_db(frame_id, camera_id, timestamp, split, img_rel_path, lbl_rel_path, len(annotations), str(classes_detected))
-        
-        logger.debug(f"Saved sample {frame_id} to {split}")
+            # Save Label
+            with open(lbl_path, 'w') as f:
+                f.write('\n'.join(annotations))
+                
+            # Log to DB
+            self.log_to_db(*db_row)
+            
+            logger.debug(f"Saved sample {db_row[0]} to {db_row[3]}")
+        except Exception as e:
+            logger.error(f"Failed to save sample {db_row[0]}: {e}")
+        finally:
+            self._write_slots.release()
 
     def log_to_db(self, frame_id, camera_id, timestamp, split, img_path, lbl_path, count, classes):
         """
-        Insert record into SQLite database.
+        Queue a record for the next batched insert into the SQLite database.
+        """
+        with self._db_lock:
+            self._db_rows.append((frame_id, camera_id, timestamp, split, img_path, lbl_path, count, classes))
+            full = len(self._db_rows) >= self.db_batch_size
+        if full:
+            self._db_wake.set()
+
+    def _flush_loop(self):
+        """
+        Background thread: flush buffered rows every db_flush_interval seconds
+        or as soon as a full batch is queued.
+        """
+        while not self._db_stop.is_set():
+            self._db_wake.wait(self.db_flush_interval)
+            self._db_wake.clear()
+            self.flush_db()
+
+    def flush_db(self):
+        """
+        Insert all buffered records in a single transaction.
         """
+        with self._db_lock:
+            rows, self._db_rows = self._db_rows, []
+        if not rows:
+            return
+
         try:
-            conn = sqlite3.connect(self.db_path)
-            c = conn.cursor()
-            c.execute('''
+            self.conn.execute('BEGIN')
+            self.conn.executemany('''
                 INSERT INTO frames (id, camera_id, timestamp, split, image_path, label_path, objects_count, classes)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (frame_id, camera_id, timestamp, split, img_path, lbl_path, count, classes))
-            conn.commit()
-            conn.close()
+            ''', rows)
+            self.conn.execute('COMMIT')
         except Exception as e:
-            logger.error(f"Failed to log to DB: {e}")
+            if self.conn.in_transaction:
+                self.conn.execute('ROLLBACK')
+            logger.error(f"Failed to log {len(rows)} records to DB: {e}")
+
+    def stop(self):
+        """
+        Finish queued writes, stop the flusher thread, write any pending records
+        and close the database.
+        """
+        self._io_pool.shutdown(wait=True)
+        self._db_stop.set()
+        self._db_wake.set()
+        self._db_thread.join()
+        self.flush_db()
+        self.conn.close()
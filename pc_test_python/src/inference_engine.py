@@ -1,9 +1,9 @@
+import os
 import time
 import logging
 import numpy as np
 import cv2
-import threading
-from queue import Queue
+from queue import Queue, Empty
 
 from .utils import setup_logger
 
@@ -33,8 +33,18 @@ class InferenceEngine:
         self.model_path = self.config['model_path']
         self.input_shape = tuple(self.config['input_shape']) # (640, 640)
         self.score_threshold = self.config.get('score_threshold', 0.5)
+        # Ultralytics fallback precision: fp32, fp16 (half-precision on CUDA) or int8 (TensorRT engine)
+        self.precision = self.config.get('precision', 'fp32')
         self.running = False
         self.yolo_model = None
+        # Mock mode: one reusable fake mask per frame size, and optional simulated latency
+        self._mock_mask_cache = {}
+        self.mock_latency = self.config.get('mock_latency_ms', 0) / 1000.0
+        # Frames per forward pass; defaults to one per enabled camera
+        self.batch_size = self.config.get('batch_size') or max(
+            1, sum(1 for cam in config.get('cameras', []) if cam.get('enabled', True)))
+        # Finished inferences waiting for get_result()
+        self.out_q = Queue()
         
         # Initialize Ultralytics or Mock
         if ULTRALYTICS_AVAILABLE and self.model_path.endswith('.pt'):
@@ -47,13 +57,43 @@ class InferenceEngine:
         Initialize Ultralytics YOLO for PC testing.
         """
         try:
-            logger.info(f"Loading Ultralytics model: {self.model_path}")
-            self.yolo_model = YOLO(self.model_path)
+            model_path = self.model_path
+            if self.precision == 'int8':
+                model_path = self._int8_engine() or model_path
+            logger.info(f"Loading Ultralytics model: {model_path}")
+            self.yolo_model = YOLO(model_path)
             logger.info("Ultralytics model loaded successfully.")
         except Exception as e:
             logger.error(f"Failed to load Ultralytics model: {e}")
             self._init_mock()
 
+    def _int8_engine(self):
+        """
+        Return the INT8 TensorRT engine next to the .pt model, exporting it once if missing.
+        INT8 calibration needs a dataset yaml (inference.calibration_data), e.g. one
+        pointing at the train split collected by the DatasetWriter.
+        """
+        # The batch is part of the name so an engine built for fewer cameras is not reused
+        engine_path = f"{os.path.splitext(self.model_path)[0]}_int8_b{self.batch_size}.engine"
+        if os.path.exists(engine_path):
+            return engine_path
+
+        calibration_data = self.config.get('calibration_data')
+        if not calibration_data:
+            logger.warning("precision 'int8' requires inference.calibration_data to build an engine. Using FP32 weights.")
+            return None
+
+        try:
+            logger.info(f"Exporting INT8 TensorRT engine for {self.model_path} (batch={self.batch_size}, one-time)...")
+            exported = YOLO(self.model_path).export(format='engine', int8=True, data=calibration_data,
+                                                    imgsz=list(self.input_shape), batch=self.batch_size,
+                                                    dynamic=self.batch_size > 1)
+            os.replace(exported, engine_path)
+            return engine_path
+        except Exception as e:
+            logger.error(f"INT8 engine export failed: {e}. Using FP32 weights.")
+            return None
+
     def _init_mock(self):
         """
         Initialize Mock engine for testing without hardware.
@@ -72,82 +112,141 @@ class InferenceEngine:
         """
         self.running = False
 
+    def submit(self, frames):
+        """
+        Queue frames for inference. Results are collected with get_result().
+        The PC backends run the batch synchronously before returning.
+        Args:
+            frames: Dict {camera_id: frame}.
+        """
+        if not self.running or not frames:
+            return
+        
+        for cam_id, results in self.infer_batch(frames).items():
+            self.out_q.put((cam_id, frames[cam_id], results))
+
+    def get_result(self, timeout=None):
+        """
+        Pop the next finished inference.
+        Args:
+            timeout: Seconds to wait; None returns immediately.
+        Returns:
+            Tuple (camera_id, frame, (masks, class_ids, scores)) or None if nothing is ready.
+        """
+        try:
+            if timeout is None:
+                return self.out_q.get_nowait()
+            return self.out_q.get(timeout=timeout)
+        except Empty:
+            return None
+
     def infer(self, frame):
         """
         Run inference on a single frame.
         Args:
             frame: Input image.
         Returns: 
-            Tuple (masks, class_ids, scores)
+            Tuple (masks, class_ids, scores) of arrays: uint8 (N, H, W), int32 (N,) and float32 (N,).
         """
         if not self.running:
             return None
         
         if self.yolo_model:
-            return self.infer_ultralytics(frame)
+            return self.infer_ultralytics([frame])[0]
         else:
             return self.mock_inference(frame.shape)
 
-    def infer_ultralytics(self, frame):
+    def infer_batch(self, frames):
+        """
+        Run inference on several frames at once.
+        Args:
+            frames: Dict {camera_id: frame}.
+        Returns:
+            Dict {camera_id: (masks, class_ids, scores)}
+        """
+        if not self.running or not frames:
+            return {}
+        
+        if self.yolo_model:
+            # One model call for all cameras; Ultralytics letterboxes each frame itself
+            results = self.infer_ultralytics(list(frames.values()))
+            return dict(zip(frames.keys(), results))
+        return {cam_id: self.infer(frame) for cam_id, frame in frames.items()}
+
+    def infer_ultralytics(self, frames):
         """
         Run inference using Ultralytics YOLO (PC mode).
+        Args:
+            frames: List of input images, run in batches of at most batch_size.
+        Returns:
+            List of (masks, class_ids, scores) tuples, one per frame.
         """
-        results = self.yolo_model(frame, verbose=False, conf=self.score_threshold)
+        outputs = []
+        # A TensorRT engine rejects batches larger than the one it was exported with
+        for start in range(0, len(frames), self.batch_size):
+            chunk = frames[start:start + self.batch_size]
+            results = self.yolo_model(chunk, verbose=False, conf=self.score_threshold,
+                                      half=self.precision == 'fp16')
+            outputs.extend(self.parse_ultralytics(r, frame.shape) for r, frame in zip(results, chunk))
+        return outputs
+
+    def parse_ultralytics(self, r, shape):
+        """
+        Convert one Ultralytics Results object into (masks, class_ids, scores) arrays.
+        """
+        if not r.boxes:
+            return self.empty_results(shape)
         
-        masks = []
-        class_ids = []
-        scores = []
+        # boxes.data is (N, 6): x1, y1, x2, y2, conf, cls -> one device-to-host copy for all boxes
+        box_data = r.boxes.data.cpu().numpy()
+        class_ids = box_data[:, 5].astype(np.int32)
+        scores = box_data[:, 4].astype(np.float32)
         
-        for r in results:
-            if r.masks:
-                # Segmentation results
-                # r.masks.data contains the masks (N, H, W)
-                masks_data = r.masks.data.cpu().numpy()
-                
-                for i, box in enumerate(r.boxes):
-                    cls_id = int(box.cls[0])
-                    conf = float(box.conf[0])
-                    
-                    # Get mask for this detection
-                    mask_raw = masks_data[i]
-                    
-                    # Ensure it is uint8 [0, 255]
-                    # Ultralytics masks are often float [0,1], convert to uint8
-                    if mask_raw.dtype != np.uint8:
-                         mask_uint8 = (mask_raw * 255).astype(np.uint8)
-                    else:
-                         mask_uint8 = mask_raw
-                    
-                    masks.append(mask_uint8)
-                    class_ids.append(cls_id)
-                    scores.append(conf)
+        if r.masks:
+            # Segmentation results
+            # r.masks.data contains the masks (N, H, W)
+            masks_data = r.masks.data
             
-            elif r.boxes:
-                # Detection results (no masks) -> Fallback to Box-as-Mask
-                h, w = frame.shape[:2]
-                for box in r.boxes:
-                    cls_id = int(box.cls[0])
-                    conf = float(box.conf[0])
-                    
-                    # Get box coordinates
-                    x1, y1, x2, y2 = map(int, box.xyxy[0].cpu().numpy())
-                    
-                    # Clip to image bounds
-                    x1 = max(0, x1)
-                    y1 = max(0, y1)
-                    x2 = min(w, x2)
-                    y2 = min(h, y2)
-                    
-                    # Create binary mask from box
-                    mask = np.zeros((h, w), dtype=np.uint8)
-                    cv2.rectangle(mask, (x1, y1), (x2, y2), 255, -1)
-                    
-                    masks.append(mask)
-                    class_ids.append(cls_id)
-                    scores.append(conf)
+            # Ensure it is uint8 [0, 255]
+            # Ultralytics masks are often float [0,1]; scale and cast the whole
+            # stack on the device, then copy it to the host in one transfer
+            if masks_data.is_floating_point():
+                masks_data = masks_data.mul(255).byte()
+            
+            # One contiguous (N, H, W) host array for all detections
+            masks = np.ascontiguousarray(masks_data.cpu().numpy())
+        
+        else:
+            # Detection results (no masks) -> Fallback to Box-as-Mask
+            masks = self.boxes_to_masks(box_data[:, :4], shape)
 
         return masks, class_ids, scores
 
+    @staticmethod
+    def boxes_to_masks(boxes, shape):
+        """
+        Rasterize (N, 4) x1, y1, x2, y2 boxes into (N, H, W) uint8 masks.
+        """
+        h, w = shape[:2]
+        # Get all box coordinates at once, clipped to image bounds
+        boxes = boxes.astype(int)
+        np.clip(boxes[:, 0::2], 0, w, out=boxes[:, 0::2])
+        np.clip(boxes[:, 1::2], 0, h, out=boxes[:, 1::2])
+        
+        # One zeroed canvas for all detections; only the box regions are written
+        canvas = np.zeros((len(boxes), h, w), dtype=np.uint8)
+        for i, (x1, y1, x2, y2) in enumerate(boxes):
+            canvas[i, y1:y2, x1:x2] = 255
+        return canvas
+
+    @staticmethod
+    def empty_results(shape):
+        """
+        (masks, class_ids, scores) for a frame without detections.
+        """
+        h, w = shape[:2]
+        return np.zeros((0, h, w), dtype=np.uint8), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+
     def post_process(self, results, original_shape):
         """
         Convert raw Hailo output to masks/boxes.
@@ -166,24 +265,31 @@ class InferenceEngine:
         # or `hailo_rpi5_examples` post-processing code.
         
         # logger.warning("Post-processing not implemented for this model. Returning empty results.")
-        return [], [], []
+        return self.empty_results(original_shape)
 
     def mock_inference(self, shape):
         """
         Generate dummy detection data for testing.
+        The masks array is cached per frame size and shared between calls, so
+        callers must treat it as read-only.
         """
+        start = time.monotonic()
         # Generate a fake person detection
         h, w = shape[:2]
         
-        # Fake Mask: a circle in the middle
-        mask = np.zeros((h, w), dtype=np.uint8)
-        cv2.circle(mask, (w//2, h//2), h//4, 1, -1)
+        # Fake Mask: a circle in the middle, as a (1, H, W) stack
+        masks = self._mock_mask_cache.get((h, w))
+        if masks is None:
+            masks = np.zeros((1, h, w), dtype=np.uint8)
+            cv2.circle(masks[0], (w//2, h//2), h//4, 1, -1)
+            self._mock_mask_cache[(h, w)] = masks
         
-        masks = [mask]
-        class_ids = [0] # 'person'
-        scores = [0.95]
+        class_ids = np.array([0], dtype=np.int32) # 'person'
+        scores = np.array([0.95], dtype=np.float32)
         
-        # Simulate processing time (Hailo is fast, but let's say 30ms)
-        time.sleep(0.03)
+        # Optionally simulate device latency (mock_latency_ms), sleeping only for the unused budget
+        remaining = self.mock_latency - (time.monotonic() - start)
+        if remaining > 0:
+            time.sleep(remaining)
         
         return masks, class_ids, scores
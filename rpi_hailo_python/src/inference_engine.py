@@ -1,11 +1,12 @@
+import os
 import time
 import logging
 import numpy as np
 import cv2
 import threading
-from queue import Queue
+from queue import Queue, Empty
 
-from .utils import setup_logger
+from .utils import setup_logger, pin_current_thread
 
 logger = setup_logger("InferenceEngine")
 
@@ -22,6 +23,13 @@ try:
     ULTRALYTICS_AVAILABLE = True
 except ImportError:
     ULTRALYTICS_AVAILABLE = False
+
+try:
+    # Optional JIT for the Hailo post-process NMS
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
     
 # Log status after checking all backends
 if not HAILO_AVAILABLE:
@@ -30,6 +38,75 @@ if not HAILO_AVAILABLE:
     else:
         logger.warning("hailo_platform AND ultralytics not found. System will run in MOCK mode.")
 
+if NUMBA_AVAILABLE:
+    @njit(cache=True, fastmath=True)
+    def _nms_numba(boxes, scores, iou_threshold, max_boxes):
+        """
+        Greedy NMS over float32 (N, 4) x, y, w, h boxes.
+        Returns the kept indices in descending score order.
+        """
+        n = scores.shape[0]
+        order = np.argsort(-scores)
+        x2 = boxes[:, 0] + boxes[:, 2]
+        y2 = boxes[:, 1] + boxes[:, 3]
+        areas = boxes[:, 2] * boxes[:, 3]
+        suppressed = np.zeros(n, dtype=np.bool_)
+        keep = np.empty(n, dtype=np.int64)
+        count = 0
+        for i in range(n):
+            a = order[i]
+            if suppressed[a]:
+                continue
+            keep[count] = a
+            count += 1
+            if count >= max_boxes:
+                break
+            for j in range(i + 1, n):
+                b = order[j]
+                if suppressed[b]:
+                    continue
+                iw = min(x2[a], x2[b]) - max(boxes[a, 0], boxes[b, 0])
+                ih = min(y2[a], y2[b]) - max(boxes[a, 1], boxes[b, 1])
+                if iw <= 0 or ih <= 0:
+                    continue
+                inter = iw * ih
+                if inter / (areas[a] + areas[b] - inter) > iou_threshold:
+                    suppressed[b] = True
+        return keep[:count]
+
+# One VDevice per process, shared by every InferenceEngine (e.g. detection + classification HEFs)
+_vdevice = None
+_vdevice_users = 0
+_vdevice_lock = threading.Lock()
+
+def get_vdevice():
+    """
+    Return the shared VDevice, creating it on first use.
+    The round-robin scheduler time-slices the network groups configured on it,
+    so several HEFs can run on one Hailo chip. Pair with release_vdevice().
+    """
+    global _vdevice, _vdevice_users
+    with _vdevice_lock:
+        if _vdevice is None:
+            params = hpf.VDevice.create_params()
+            params.scheduling_algorithm = hpf.HailoSchedulingAlgorithm.ROUND_ROBIN
+            params.group_id = "shared"
+            _vdevice = hpf.VDevice(params=params)
+        _vdevice_users += 1
+        return _vdevice
+
+def release_vdevice():
+    """
+    Drop one reference to the shared VDevice; the last user releases it.
+    """
+    global _vdevice, _vdevice_users
+    with _vdevice_lock:
+        _vdevice_users -= 1
+        if _vdevice_users <= 0 and _vdevice is not None:
+            _vdevice.release()
+            _vdevice = None
+            _vdevice_users = 0
+
 class InferenceEngine:
     """
     Wrapper for HailoRT inference engine.
@@ -45,12 +122,40 @@ class InferenceEngine:
         self.model_path = self.config['model_path']
         self.input_shape = tuple(self.config['input_shape']) # (640, 640)
         self.score_threshold = self.config.get('score_threshold', 0.5)
+        self.iou_threshold = self.config.get('iou_threshold', 0.45)
+        self.max_boxes = self.config.get('max_boxes', 100)
+        self.num_classes = len(self.config.get('class_names', [])) or 80
+        # Ultralytics fallback precision: fp32, fp16 (half-precision on CUDA) or int8 (TensorRT engine)
+        self.precision = self.config.get('precision', 'fp32')
         self.running = False
         self.target = None
         self.network_group = None
         self.infer_pipeline = None
         self.hef = None
         self.yolo_model = None
+        # Mock mode: one reusable fake mask per frame size, and optional simulated latency
+        self._mock_mask_cache = {}
+        self.mock_latency = self.config.get('mock_latency_ms', 0) / 1000.0
+        
+        # Frames per device transfer; defaults to one per enabled camera
+        self.batch_size = self.config.get('batch_size') or max(
+            1, sum(1 for cam in config.get('cameras', []) if cam.get('enabled', True)))
+        
+        # Async pipeline: submit() -> in_q -> sender thread -> device -> receiver thread -> out_q.
+        # in_q is bounded so producers block once the device is a couple of batches behind.
+        self.in_q = Queue(maxsize=self.config.get('queue_size', 2 * self.batch_size))
+        self.out_q = Queue()
+        # Frames sent to the device, in order, waiting for their outputs
+        self._inflight = Queue()
+        # Preprocess buffer, allocated once and reused by the sender thread
+        in_w, in_h = self.input_shape
+        self._batch_buf = np.empty((self.batch_size, in_h, in_w, 3), dtype=np.uint8)
+        self.output_quant = {}
+        self._threads = []
+        # send()/recv() raise instead of blocking forever after this long, so stop() can join the threads
+        self.vstream_timeout_ms = self.config.get('vstream_timeout_ms', 2000)
+        # Optional CPU core shared by the sender/receiver threads
+        self.cpu_core = self.config.get('cpu_core')
         
         # Initialize Hailo hardware if available, else use Mock/PC fallback
         if HAILO_AVAILABLE:
@@ -65,13 +170,43 @@ class InferenceEngine:
         Initialize Ultralytics YOLO for PC testing.
         """
         try:
-            logger.info(f"Loading Ultralytics model: {self.model_path}")
-            self.yolo_model = YOLO(self.model_path)
+            model_path = self.model_path
+            if self.precision == 'int8':
+                model_path = self._int8_engine() or model_path
+            logger.info(f"Loading Ultralytics model: {model_path}")
+            self.yolo_model = YOLO(model_path)
             logger.info("Ultralytics model loaded successfully.")
         except Exception as e:
             logger.error(f"Failed to load Ultralytics model: {e}")
             self._init_mock()
 
+    def _int8_engine(self):
+        """
+        Return the INT8 TensorRT engine next to the .pt model, exporting it once if missing.
+        INT8 calibration needs a dataset yaml (inference.calibration_data), e.g. one
+        pointing at the train split collected by the DatasetWriter.
+        """
+        # The batch is part of the name so an engine built for fewer cameras is not reused
+        engine_path = f"{os.path.splitext(self.model_path)[0]}_int8_b{self.batch_size}.engine"
+        if os.path.exists(engine_path):
+            return engine_path
+
+        calibration_data = self.config.get('calibration_data')
+        if not calibration_data:
+            logger.warning("precision 'int8' requires inference.calibration_data to build an engine. Using FP32 weights.")
+            return None
+
+        try:
+            logger.info(f"Exporting INT8 TensorRT engine for {self.model_path} (batch={self.batch_size}, one-time)...")
+            exported = YOLO(self.model_path).export(format='engine', int8=True, data=calibration_data,
+                                                    imgsz=list(self.input_shape), batch=self.batch_size,
+                                                    dynamic=self.batch_size > 1)
+            os.replace(exported, engine_path)
+            return engine_path
+        except Exception as e:
+            logger.error(f"INT8 engine export failed: {e}. Using FP32 weights.")
+            return None
+
     def _init_hailo(self):
         """
         Initialize HailoRT VDevice, HEF, and Network Groups.
@@ -80,39 +215,46 @@ class InferenceEngine:
             # Load HEF model file
             self.hef = hpf.HEF(self.model_path)
             
-            # Configure VDevice Parameters
-            self.params = hpf.VDevice.create_params()
-            # self.params.scheduling_algorithm = hpf.HailoSchedulingAlgorithm.ROUND_ROBIN 
-            
-            # Create VDevice (Access to PCIe device)
-            self.target = hpf.VDevice(params=self.params)
+            # Shared VDevice (Access to PCIe device), scheduled round-robin between engines
+            self.target = get_vdevice()
             
             # Configure Network Group from HEF
             configure_params = hpf.ConfigureParams.create_from_hef(
                 hef=self.hef, 
                 interface=hpf.HailoStreamInterface.PCIe
             )
+            # Let the device run a whole tick's camera frames per transfer
+            for params in configure_params.values():
+                params.batch_size = self.batch_size
             self.network_groups = self.target.configure(self.hef, configure_params)
             self.network_group = self.network_groups[0]
             
-            self.network_group_params = self.network_group.create_params()
-            
             # Get Input/Output VStream Information
             self.input_vstream_info = self.hef.get_input_vstream_infos()[0]
             self.output_vstream_infos = self.hef.get_output_vstream_infos()
             
-            # Create Parameters for VStreams (Quantized=False for float output)
+            # Create Parameters for VStreams (Quantized=True, UINT8): tensors cross PCIe
+            # as the chip's own 8-bit values instead of host-converted float32
             self.input_vstreams_params = hpf.InputVStreamParams.make_from_network_group(
-                self.network_group, quantized=False, format_type=hpf.FormatType.FLOAT32
+                self.network_group, quantized=True, format_type=hpf.FormatType.UINT8,
+                timeout_ms=self.vstream_timeout_ms
             )
             self.output_vstreams_params = hpf.OutputVStreamParams.make_from_network_group(
-                self.network_group, quantized=False, format_type=hpf.FormatType.FLOAT32
+                self.network_group, quantized=True, format_type=hpf.FormatType.UINT8,
+                timeout_ms=self.vstream_timeout_ms
             )
+            # (zero_point, scale) per output, used to dequantize surviving detections only
+            self.output_quant = {
+                info.name: (info.quant_info.qp_zp, info.quant_info.qp_scale)
+                for info in self.output_vstream_infos
+            }
             
             logger.info(f"Hailo Inference Engine initialized with model: {self.model_path}")
             
         except Exception as e:
             logger.error(f"Failed to initialize Hailo: {e}")
+            if self.target:
+                release_vdevice()
             self.target = None
             global HAILO_AVAILABLE
             HAILO_AVAILABLE = False
@@ -126,47 +268,159 @@ class InferenceEngine:
 
     def start(self):
         """
-        Activate the network group and start the inference pipeline.
+        Activate the network group and start the send/receive pipeline threads.
         """
         self.running = True
         if HAILO_AVAILABLE and self.target:
-            self.network_group.activate(self.network_group_params)
-            # Create pipeline context
-            self.pipeline = hpf.InferVStreams(
-                self.network_group, 
-                self.input_vstreams_params, 
-                self.output_vstreams_params
-            )
-            self.pipeline.__enter__()
+            # The scheduler activates the network group on demand, so there is no
+            # manual activate(). Contexts are entered manually because they persist across infer calls.
+            # Separate input/output vstreams so frame N+1 is written while frame N is read back
+            self.input_vstreams = hpf.InputVStreams(self.network_group, self.input_vstreams_params)
+            self.output_vstreams = hpf.OutputVStreams(self.network_group, self.output_vstreams_params)
+            self.input_vstream = self.input_vstreams.__enter__().get(self.input_vstream_info.name)
+            self.output_vstream_list = list(self.output_vstreams.__enter__())
+            
+            self._threads = [
+                threading.Thread(target=self._sender_loop, name="HailoSend", daemon=True),
+                threading.Thread(target=self._recver_loop, name="HailoRecv", daemon=True),
+            ]
+            for t in self._threads:
+                t.start()
 
     def stop(self):
         """
         Stop the pipeline and release resources.
         """
         self.running = False
+        # A thread blocked in send()/recv() returns once the vstream timeout expires
+        for t in self._threads:
+            t.join(timeout=self.vstream_timeout_ms / 1000.0 + 1.0)
+        alive = [t.name for t in self._threads if t.is_alive()]
+        self._threads = []
         if HAILO_AVAILABLE and self.target:
-            if hasattr(self, 'pipeline') and self.pipeline:
-                self.pipeline.__exit__(None, None, None)
-            # Deactivate is handled by context managers usually, but here we did manual activation
-            # self.network_group.deactivate() # Not always needed if using 'with' block, but here we persist
-            self.target.release()
+            if alive:
+                # Tearing the vstreams down under a thread still inside them is unsafe
+                logger.error(f"{', '.join(alive)} did not exit; leaving the Hailo vstreams open.")
+                return
+            self.output_vstreams.__exit__(None, None, None)
+            self.input_vstreams.__exit__(None, None, None)
+            release_vdevice()
+            self.target = None
+
+    def _pin_thread(self):
+        """
+        Pin the calling pipeline thread to the configured core, if any.
+        """
+        if self.cpu_core is not None and not pin_current_thread(self.cpu_core):
+            logger.warning(f"Could not pin {threading.current_thread().name} to core {self.cpu_core}")
+
+    def _sender_loop(self):
+        """
+        Sender thread: preprocess queued frames and write them to the device.
+        """
+        self._pin_thread()
+        while self.running:
+            try:
+                items = [self.in_q.get(timeout=0.1)]
+            except Empty:
+                continue
+            # Gather whatever else is already queued, up to the configured batch size
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self.in_q.get_nowait())
+                except Empty:
+                    break
+            
+            try:
+                # Preprocess straight into the reusable batch buffer; send() copies it out
+                batch = self._batch_buf[:len(items)]
+                for i, (_, frame, _) in enumerate(items):
+                    self.preprocess(frame, out=batch[i])
+                self.input_vstream.send(batch)
+            except Exception as e:
+                logger.error(f"Hailo send failed for {len(items)} frame(s): {e}")
+                # Answer every frame so callers waiting on it (e.g. DataCollector.pending) move on
+                for key, frame, reply_q in items:
+                    reply_q.put((key, frame, self.empty_results(frame.shape)))
+                continue
+            # Register the frames once they are on the device; outputs stay buffered in the
+            # output vstreams until the receiver reads them, in the same order
+            for item in items:
+                self._inflight.put(item)
+
+    def _recver_loop(self):
+        """
+        Receiver thread: read outputs in send order, post-process them and hand
+        the result to whoever queued the frame.
+        """
+        self._pin_thread()
+        while self.running:
+            try:
+                key, frame, reply_q = self._inflight.get(timeout=0.1)
+            except Empty:
+                continue
+            try:
+                raw = {vstream.name: vstream.recv() for vstream in self.output_vstream_list}
+                results = self.post_process_hailo(raw, frame.shape)
+            except Exception as e:
+                logger.error(f"Hailo receive/post-process failed for {key}: {e}")
+                results = self.empty_results(frame.shape)
+            reply_q.put((key, frame, results))
+
+    def submit(self, frames):
+        """
+        Queue frames for inference. Results are collected with get_result().
+        On Hailo this returns as soon as the frames are queued (blocking only for
+        back-pressure); the other backends run the batch synchronously.
+        Args:
+            frames: Dict {camera_id: frame}. Frames must not be modified until their result is returned.
+        """
+        if not self.running or not frames:
+            return
+        
+        if HAILO_AVAILABLE and self.target:
+            for cam_id, frame in frames.items():
+                self.in_q.put((cam_id, frame, self.out_q))
+        else:
+            for cam_id, results in self.infer_batch(frames).items():
+                self.out_q.put((cam_id, frames[cam_id], results))
 
-    def preprocess(self, frame):
+    def get_result(self, timeout=None):
+        """
+        Pop the next finished inference.
+        Args:
+            timeout: Seconds to wait; None returns immediately.
+        Returns:
+            Tuple (camera_id, frame, (masks, class_ids, scores)) or None if nothing is ready.
+        """
+        try:
+            if timeout is None:
+                return self.out_q.get_nowait()
+            return self.out_q.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def preprocess(self, frame, out=None):
         """
         Preprocess the input frame for the model.
+        Runs on the sender thread and writes into preallocated buffers, so the
+        result is only valid until the next call.
         Args:
             frame: Raw input image (numpy array).
+            out: Optional uint8 (H, W, 3) array to write into.
         Returns:
-            Preprocessed frame (resized, normalized, float32).
+            Preprocessed frame (resized, uint8).
         """
-        # Resize and Normalize
-        resized = cv2.resize(frame, self.input_shape)
-        # Assuming model expects float32 normalized 0-1 or 0-255 depending on HEF
-        # Usually Hailo HEF expects uint8 if quantized=True in VStream, but we set quantized=False, FLOAT32
-        # So we likely need to normalize to 0-1 if the model was trained that way, 
-        # BUT often Hailo Input conversion handles this.
-        # Safe bet: pass float32 0-255 or 0-1. Let's assume 0-255 float.
-        return resized.astype(np.float32)
+        if out is None:
+            out = self._batch_buf[0]
+        # The input vstream is quantized UINT8, which is what the HEF's input layer
+        # expects: normalization is folded into the model, so only resize here
+        if frame.shape[:2] == out.shape[:2]:
+            # Already decoded at the network resolution (decode_resolution): plain copy
+            np.copyto(out, frame)
+        else:
+            cv2.resize(frame, self.input_shape, dst=out, interpolation=cv2.INTER_LINEAR)
+        return out
 
     def infer(self, frame):
         """
@@ -174,61 +428,206 @@ class InferenceEngine:
         Args:
             frame: Input image.
         Returns: 
-            Tuple (masks, class_ids, scores)
+            Tuple (masks, class_ids, scores) of arrays: uint8 (N, H, W), int32 (N,) and float32 (N,).
         """
         if not self.running:
             return None
-
-        processed_frame = self.preprocess(frame)
         
         if HAILO_AVAILABLE and self.target:
-            # Prepare input dictionary mapping stream name to data
-            input_data = {self.input_vstream_info.name: np.expand_dims(processed_frame, axis=0)}
-            # Run inference
-            results = self.pipeline.infer(input_data)
-            return self.post_process_hailo(results, frame.shape)
+            # Go through the async pipeline and wait for this frame's own reply
+            reply_q = Queue(maxsize=1)
+            self.in_q.put((None, frame, reply_q))
+            return reply_q.get()[2]
         elif self.yolo_model:
-            return self.infer_ultralytics(frame)
+            return self.infer_ultralytics([frame])[0]
         else:
             return self.mock_inference(frame.shape)
 
+    def infer_batch(self, frames):
+        """
+        Run inference on several frames at once.
+        Args:
+            frames: Dict {camera_id: frame}.
+        Returns:
+            Dict {camera_id: (masks, class_ids, scores)}
+        """
+        if not self.running or not frames:
+            return {}
+        
+        if HAILO_AVAILABLE and self.target:
+            # Queue all frames together so the sender ships them in one batch
+            reply_q = Queue()
+            for cam_id, frame in frames.items():
+                self.in_q.put((cam_id, frame, reply_q))
+            results = {}
+            for _ in frames:
+                cam_id, _, result = reply_q.get()
+                results[cam_id] = result
+            return results
+        elif self.yolo_model:
+            # One model call for all cameras; Ultralytics letterboxes each frame itself
+            results = self.infer_ultralytics(list(frames.values()))
+            return dict(zip(frames.keys(), results))
+        return {cam_id: self.infer(frame) for cam_id, frame in frames.items()}
+
+    def infer_ultralytics(self, frames):
+        """
+        Run inference using Ultralytics YOLO (PC mode).
+        Args:
+            frames: List of input images, run in batches of at most batch_size.
+        Returns:
+            List of (masks, class_ids, scores) tuples, one per frame.
+        """
+        outputs = []
+        # A TensorRT engine rejects batches larger than the one it was exported with
+        for start in range(0, len(frames), self.batch_size):
+            chunk = frames[start:start + self.batch_size]
+            results = self.yolo_model(chunk, verbose=False, conf=self.score_threshold,
+                                      half=self.precision == 'fp16')
+            outputs.extend(self.parse_ultralytics(r, frame.shape) for r, frame in zip(results, chunk))
+        return outputs
+
+    def parse_ultralytics(self, r, shape):
+        """
+        Convert one Ultralytics Results object into (masks, class_ids, scores) arrays.
+        """
+        if not r.boxes:
+            return self.empty_results(shape)
+        
+        # boxes.data is (N, 6): x1, y1, x2, y2, conf, cls -> one device-to-host copy for all boxes
+        box_data = r.boxes.data.cpu().numpy()
+        class_ids = box_data[:, 5].astype(np.int32)
+        scores = box_data[:, 4].astype(np.float32)
+        
+        if r.masks:
+            # Segmentation results
+            # r.masks.data contains the masks (N, H, W)
+            masks_data = r.masks.data
+            
+            # Ensure it is uint8 [0, 255]
+            # Ultralytics masks are often float [0,1]; scale and cast the whole
+            # stack on the device, then copy it to the host in one transfer
+            if masks_data.is_floating_point():
+                masks_data = masks_data.mul(255).byte()
+            
+            # One contiguous (N, H, W) host array for all detections
+            masks = np.ascontiguousarray(masks_data.cpu().numpy())
+        
+        else:
+            # Detection results (no masks) -> Fallback to Box-as-Mask
+            masks = self.boxes_to_masks(box_data[:, :4], shape)
+
+        return masks, class_ids, scores
+
+    @staticmethod
+    def boxes_to_masks(boxes, shape):
+        """
+        Rasterize (N, 4) x1, y1, x2, y2 boxes into (N, H, W) uint8 masks.
+        """
+        h, w = shape[:2]
+        # Get all box coordinates at once, clipped to image bounds
+        boxes = boxes.astype(int)
+        np.clip(boxes[:, 0::2], 0, w, out=boxes[:, 0::2])
+        np.clip(boxes[:, 1::2], 0, h, out=boxes[:, 1::2])
+        
+        # One zeroed canvas for all detections; only the box regions are written
+        canvas = np.zeros((len(boxes), h, w), dtype=np.uint8)
+        for i, (x1, y1, x2, y2) in enumerate(boxes):
+            canvas[i, y1:y2, x1:x2] = 255
+        return canvas
+
+    @staticmethod
+    def empty_results(shape):
+        """
+        (masks, class_ids, scores) for a frame without detections.
+        """
+        h, w = shape[:2]
+        return np.zeros((0, h, w), dtype=np.uint8), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+
     def post_process_hailo(self, results, original_shape):
         """
         Process raw Hailo output tensors into masks, class_ids, and scores.
-        NOTE: This is a placeholder structure. Actual implementation depends heavily
-        on the specific output layers of the compiled HEF.
+        NOTE: Actual output layouts depend heavily on how the HEF was compiled.
         
         Typically Hailo TAPPAS or hailo_model_zoo provides parsers.
-        For raw YOLOv8 output, we usually get concatenated outputs or 3 separate heads.
+        This decoder assumes decoded YOLO heads whose rows are (cx, cy, w, h) in
+        network-input pixels followed by one logit per class. Models compiled with
+        on-chip NMS or DFL box heads need their own parser.
         
-        This simple implementation assumes the model was compiled with NMS on-chip
-        or standard YOLO output structure.
+        The whole decode is vectorized: every head is flattened into one
+        (anchors, 4 + num_classes) array and filtered before any per-box work.
+        Heads arrive as quantized uint8; filtering happens on the raw values and
+        only the surviving rows are dequantized.
+        Masks are box-shaped, as in the Ultralytics detection fallback.
         """
-        # TODO: Implement specific decoding logic based on HEF output layers.
-        # For now, return empty lists to prevent crash if run on hardware without full parser.
-        # In a real scenario, you would parse 'results' which is a dict of {output_layer_name: numpy_array}
+        row = 4 + self.num_classes
+        # Sigmoid is monotonic, so threshold the best logit against logit(threshold)
+        threshold_logit = np.log(self.score_threshold / (1.0 - self.score_threshold))
+        
+        survivors = []
+        for name, r in results.items():
+            if np.size(r) % row:
+                continue
+            r = np.asarray(r).reshape(-1, row)
+            zp, scale = self.output_quant.get(name, (0.0, 1.0))
+            # Compare in the quantized domain: logit = (q - zp) * scale
+            keep = r[:, 4:].max(axis=1) > threshold_logit / scale + zp
+            if keep.any():
+                survivors.append((r[keep].astype(np.float32) - zp) * scale)
+        if not survivors:
+            return self.empty_results(original_shape)
+        raw = np.concatenate(survivors, axis=0)
+        
+        logits = raw[:, 4:]
+        boxes = raw[:, :4]
+        class_ids = logits.argmax(axis=1)
+        scores = 1.0 / (1.0 + np.exp(-logits.max(axis=1)))
         
-        # Example pseudo-code for a model compiled with meta-arch (NMS included):
-        # detections = results['detections'] # shape [N, 6] (x1, y1, x2, y2, score, class)
+        # (cx, cy, w, h) in network pixels -> (x, y, w, h) in frame pixels
+        h, w = original_shape[:2]
+        scale = np.array([w / self.input_shape[0], h / self.input_shape[1]] * 2, dtype=np.float32)
+        boxes = boxes * scale
+        boxes[:, :2] -= boxes[:, 2:] / 2
+        
+        # One NMS call over all survivors (JIT-compiled when numba is installed)
+        if NUMBA_AVAILABLE:
+            idx = _nms_numba(np.ascontiguousarray(boxes, dtype=np.float32), scores.astype(np.float32),
+                             self.iou_threshold, self.max_boxes)
+        else:
+            idx = cv2.dnn.NMSBoxes(boxes.tolist(), scores.tolist(), self.score_threshold,
+                                   self.iou_threshold, top_k=self.max_boxes)
+            idx = np.asarray(idx, dtype=int).reshape(-1)
+        if idx.size == 0:
+            return self.empty_results(original_shape)
         
-        return [], [], []
+        xyxy = boxes[idx].copy()
+        xyxy[:, 2:] += xyxy[:, :2]
+        masks = self.boxes_to_masks(xyxy, original_shape)
+        return masks, class_ids[idx].astype(np.int32), scores[idx].astype(np.float32)
 
     def mock_inference(self, shape):
         """
         Generate dummy detection data for testing.
+        The masks array is cached per frame size and shared between calls, so
+        callers must treat it as read-only.
         """
+        start = time.monotonic()
         # Generate a fake person detection
         h, w = shape[:2]
         
-        # Fake Mask: a circle in the middle
-        mask = np.zeros((h, w), dtype=np.uint8)
-        cv2.circle(mask, (w//2, h//2), h//4, 1, -1)
+        # Fake Mask: a circle in the middle, as a (1, H, W) stack
+        masks = self._mock_mask_cache.get((h, w))
+        if masks is None:
+            masks = np.zeros((1, h, w), dtype=np.uint8)
+            cv2.circle(masks[0], (w//2, h//2), h//4, 1, -1)
+            self._mock_mask_cache[(h, w)] = masks
         
-        masks = [mask]
-        class_ids = [0] # 'person'
-        scores = [0.95]
+        class_ids = np.array([0], dtype=np.int32) # 'person'
+        scores = np.array([0.95], dtype=np.float32)
         
-        # Simulate processing time (Hailo is fast, but let's say 30ms)
-        time.sleep(0.03)
+        # Optionally simulate device latency (mock_latency_ms), sleeping only for the unused budget
+        remaining = self.mock_latency - (time.monotonic() - start)
+        if remaining > 0:
+            time.sleep(remaining)
         
         return masks, class_ids, scores
@@ -4,14 +4,22 @@ import sys
 import argparse
 import os
 import cv2
-from .utils import load_config, setup_logger, mask_to_polygon, format_yolo_label
+import threading
+import numpy as np
+from .utils import load_config, setup_logger, mask_to_polygon, format_yolo_label, dhash, pin_current_thread
 from .camera_manager import CameraManager
-from .inference_engine import InferenceEngine
 from .dataset_writer import DatasetWriter
 
 # Initialize the logger for the main module
 logger = setup_logger("Main")
 
+try:
+    # Optional Prometheus exporter for the pipeline counters
+    from prometheus_client import Gauge, start_http_server
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
 class DataCollector:
     """
     Main controller class for the Data Collector system.
@@ -27,6 +35,22 @@ class DataCollector:
         self.config = load_config(config_path)
         self.running = True
         
+        # Keep OpenCV's internal thread pool from competing with the capture,
+        # inference and writer threads for the same cores
+        system_config = self.config.get('system', {})
+        cv2.setNumThreads(system_config.get('opencv_threads', 1))
+        # OpenMP/MKL pools (torch in the Ultralytics fallback) size themselves when the
+        # backend is first imported, so the limit is exported before importing it below
+        backend_threads = system_config.get('backend_threads')
+        if backend_threads:
+            os.environ['OMP_NUM_THREADS'] = str(backend_threads)
+            os.environ['MKL_NUM_THREADS'] = str(backend_threads)
+        from .inference_engine import InferenceEngine
+        # Optional core(s) for the main loop, applied once the worker threads are running
+        self.cpu_core = system_config.get('cpu_core')
+        # Set on shutdown so idle waits end immediately
+        self.stop_event = threading.Event()
+        
         # Init Components
         # Initialize Camera Manager to handle RTSP streams
         self.camera_manager = CameraManager(self.config)
@@ -37,14 +61,45 @@ class DataCollector:
         
         # Load class names mapping
         self.class_names = self.config['inference'].get('class_names', [])
-        # Load target classes to filter (if any)
-        self.target_classes = set(self.config['collection'].get('target_classes', []))
+        # Load target classes to filter (if any). YAML reads bare IDs like [0, 2] as ints,
+        # so normalize to strings: names and numeric IDs are then compared the same way
+        self.target_classes = frozenset(str(n) for n in self.config['collection'].get('target_classes') or [])
         # Load minimum confidence threshold
         self.min_confidence = self.config['collection'].get('min_confidence', 0.6)
+        # Per-class confidence gate: min_confidence for wanted classes, +inf for the rest.
+        # Unnamed IDs are matched by their number; the last entry covers every ID past the
+        # table (looked up with mode='clip').
+        names = self.class_names
+        ids = [i for i, n in enumerate(names) if n in self.target_classes]
+        ids += [int(n) for n in self.target_classes if n.isdigit() and int(n) >= len(names)]
+        self.class_thresh = np.full(max([len(names)] + [i + 1 for i in ids]) + 1,
+                                    np.inf if self.target_classes else self.min_confidence, dtype=np.float32)
+        self.class_thresh[ids] = self.min_confidence
+        # Near-duplicate filter: max dHash Hamming distance treated as the same scene (0 disables)
+        self.dedupe_threshold = self.config['collection'].get('dedupe_hamming_thresh', 6)
+        self.last_saved = {} # camera_id -> (dhash, class set) of the last saved sample
         
         # Capture interval in seconds
         self.capture_interval = self.config['collection'].get('interval_seconds', 5.0)
-        self.last_capture_times = {} # Dictionary to track last capture time per camera
+        # Monotonic time each camera is next due for a capture (0 = due now). Monotonic so
+        # an NTP step of the wall clock (the Pi has no RTC) cannot stall or rush captures.
+        self.next_capture = dict.fromkeys(self.camera_manager.cameras, 0.0)
+        self.pending = set() # Cameras with a frame still in the inference pipeline
+        
+        # Pipeline counters, logged and reset every metrics.log_interval seconds (0 disables)
+        metrics_config = self.config.get('metrics', {})
+        self.stats_interval = metrics_config.get('log_interval', 10.0)
+        self.stats = dict.fromkeys(
+            ['frames', 'submitted', 'inferred', 'saved', 'duplicates', 'dropped', 'in_flight_hwm'], 0)
+        self.stats_since = time.monotonic()
+        self.stats_gauge = None
+        if metrics_config.get('prometheus', False):
+            if PROMETHEUS_AVAILABLE:
+                start_http_server(metrics_config.get('port', 9100))
+                self.stats_gauge = Gauge('datacollector_window_events',
+                                         'Pipeline events in the last reporting window', ['event'])
+            else:
+                logger.warning("metrics.prometheus is enabled but prometheus_client is not installed.")
 
         # Register signal handlers for graceful shutdown
         signal.signal(signal.SIGINT, self.shutdown)
@@ -56,6 +111,7 @@ class DataCollector:
         """
         logger.info("Shutdown signal received...")
         self.running = False
+        self.stop_event.set()
 
     def run(self):
         """
@@ -69,67 +125,74 @@ class DataCollector:
         # Start the inference engine (activates Hailo network)
         self.inference_engine.start()
         
+        # Pin only now so the camera and inference threads do not inherit the main loop's cores.
+        # Sample writer threads start later from this thread; they re-pin themselves.
+        if self.cpu_core is not None and not pin_current_thread(self.cpu_core):
+            logger.warning(f"Could not pin the main loop to core {self.cpu_core}")
+        
         logger.info("System running. Press Ctrl+C to stop.")
         
         try:
             while self.running:
+                now = time.monotonic()
+                self.report_stats(now)
+                
+                # Idle: nothing in flight and no camera due yet, so skip the frame fetch and
+                # inference until the earliest camera is due. Cameras keep streaming meanwhile.
+                if not self.pending:
+                    next_due = min(self.next_capture.values(), default=now)
+                    if next_due > now:
+                        self.stop_event.wait(next_due - now)
+                        continue
+                
                 # Retrieve the latest frames from all connected cameras
                 frames = self.camera_manager.get_frames()
-                current_time = time.time()
                 
+                # Frames that are due for inference this tick
+                due_frames = {}
                 for cam_id, frame in frames.items():
-                    # Check if enough time has passed since last capture for this camera
-                    last_time = self.last_capture_times.get(cam_id, 0)
-                    if current_time - last_time < self.capture_interval:
+                    # No new frame from this camera
+                    if frame is None:
+                        continue
+                    self.stats['frames'] += 1
+                    
+                    # Its previous frame is still in the pipeline
+                    if cam_id in self.pending:
+                        continue
+                    
+                    # Check if this camera's capture deadline has passed
+                    if now < self.next_capture[cam_id]:
                         continue
 
                     # Check for motion if configured
                     if not self.camera_manager.check_motion(cam_id, frame):
                         # No motion detected, skip inference to save resources
                         continue
-                        
-                    # Run inference on the current frame
-                    results = self.inference_engine.infer(frame)
-                    if not results:
-                        continue
-                        
-                    # Unpack results: binary masks, class IDs, and confidence scores
-                    masks, class_ids, scores = results
-                    
-                    # Lists to hold formatted annotations and detected class names
-                    yolo_annotations = []
-                    classes_detected = []
                     
-                    for mask, cls_id, score in zip(masks, class_ids, scores):
-                        # Filter detections below confidence threshold
-                        if score < self.min_confidence:
-                            continue
-                            
-                        # Get class name from ID
-                        class_name = self.class_names[cls_id] if cls_id < len(self.class_names) else str(cls_id)
-                        
-                        # Filter by target class if whitelist is configured
-                        if self.target_classes and class_name not in self.target_classes:
-                            continue
-                            
-                        # Convert binary mask to normalized polygon coordinates
-                        polygons = mask_to_polygon(mask)
-                        if not polygons:
-                            continue
-                            
-                        # Format polygon into YOLO segmentation label format
-                        lines = format_yolo_label(cls_id, polygons)
-                        yolo_annotations.extend(lines)
-                        classes_detected.append(class_name)
-                    
-                    # Save the sample if valid annotations were found (or if configured to save empty frames)
-                    if yolo_annotations:
-                        self.dataset_writer.save_sample(frame, cam_id, yolo_annotations, classes_detected)
-                        self.last_capture_times[cam_id] = current_time
-                        logger.info(f"Captured sample from {cam_id}: {len(yolo_annotations)} objects")
+                    # get_frame() already returned our own copy, so inference and the
+                    # writer can keep it while the capture thread recycles its slots
+                    due_frames[cam_id] = frame
+                
+                # Producer: queue the due frames (Hailo runs them asynchronously)
+                self.pending.update(due_frames)
+                self.inference_engine.submit(due_frames)
+                self.stats['submitted'] += len(due_frames)
+                self.stats['in_flight_hwm'] = max(self.stats['in_flight_hwm'], len(self.pending))
                 
-                # Sleep briefly to prevent high CPU usage in the main loop
-                time.sleep(0.1)
+                # Consumer: handle every inference that finished since the last tick
+                while True:
+                    item = self.inference_engine.get_result()
+                    if item is None:
+                        break
+                    cam_id, frame, results = item
+                    self.pending.discard(cam_id)
+                    self.stats['inferred'] += 1
+                    if results:
+                        self.process_results(cam_id, frame, results, now)
+                
+                # Sleep until a camera publishes a new frame instead of polling.
+                # The timeout still lets finished inferences drain if cameras go quiet.
+                self.camera_manager.wait_for_frames(timeout=self.capture_interval)
                 
         except Exception as e:
             logger.error(f"Runtime error: {e}", exc_info=True)
@@ -137,6 +200,87 @@ class DataCollector:
             # Ensure resources are cleaned up on exit
             self.cleanup()
 
+    def process_results(self, cam_id, frame, results, now):
+        """
+        Filter the detections for one frame, convert them to YOLO labels and save the sample.
+        """
+        # Unpack results: uint8 (N, H, W) masks, int32 class IDs and float32 scores
+        masks, class_ids, scores = results
+        
+        # Lists to hold formatted annotations and detected class names
+        yolo_annotations = []
+        classes_detected = []
+        
+        # Confidence threshold and target class whitelist in one vectorized compare
+        keep = scores >= self.class_thresh.take(class_ids, mode='clip')
+        
+        # Bind per-detection lookups once per frame
+        names = self.class_names
+        num_names = len(names)
+        
+        for idx in np.flatnonzero(keep):
+            mask = masks[idx]
+            cls_id = int(class_ids[idx])
+            # Get class name from ID
+            class_name = names[cls_id] if cls_id < num_names else str(cls_id)
+                
+            # Convert binary mask to normalized polygon coordinates
+            polygons = mask_to_polygon(mask)
+            if not polygons:
+                continue
+                
+            # Format polygon into YOLO segmentation label format
+            lines = format_yolo_label(cls_id, polygons)
+            yolo_annotations.extend(lines)
+            classes_detected.append(class_name)
+        
+        if not yolo_annotations:
+            return
+        
+        # Skip near-duplicates of this camera's last saved sample (static scene, same classes).
+        # The interval still restarts so the unchanged scene is not re-inferred every frame.
+        if self.dedupe_threshold > 0:
+            frame_hash = dhash(frame)
+            class_set = frozenset(classes_detected)
+            last = self.last_saved.get(cam_id)
+            if last and last[1] == class_set and bin(frame_hash ^ last[0]).count('1') < self.dedupe_threshold:
+                self.schedule_next(cam_id, now)
+                self.stats['duplicates'] += 1
+                logger.debug(f"Skipped near-duplicate sample from {cam_id}")
+                return
+        
+        # Save the sample if valid annotations were found
+        if self.dataset_writer.save_sample(frame, cam_id, yolo_annotations, classes_detected):
+            self.schedule_next(cam_id, now)
+            if self.dedupe_threshold > 0:
+                self.last_saved[cam_id] = (frame_hash, class_set)
+            self.stats['saved'] += 1
+            logger.info(f"Captured sample from {cam_id}: {len(yolo_annotations)} objects")
+        else:
+            self.stats['dropped'] += 1
+
+    def report_stats(self, now):
+        """
+        Log (and export) the counters once the reporting window has elapsed, then reset them.
+        """
+        elapsed = now - self.stats_since
+        if not self.stats_interval or elapsed < self.stats_interval:
+            return
+        logger.info(f"Stats over {elapsed:.1f}s: " + ", ".join(f"{k}={v}" for k, v in self.stats.items()))
+        if self.stats_gauge is not None:
+            for key, value in self.stats.items():
+                self.stats_gauge.labels(key).set(value)
+        self.stats = dict.fromkeys(self.stats, 0)
+        self.stats_since = now
+
+    def schedule_next(self, cam_id, now):
+        """
+        Make a camera due again after the capture interval. Until then its
+        capture thread skips converting frames nobody will look at.
+        """
+        self.next_capture[cam_id] = now + self.capture_interval
+        self.camera_manager.defer_frames(cam_id, self.next_capture[cam_id])
+
     def cleanup(self):
         """
         Stop services and release resources.
@@ -144,6 +288,7 @@ class DataCollector:
         logger.info("Cleaning up resources...")
         self.camera_manager.stop_all()
         self.inference_engine.stop()
+        self.dataset_writer.stop()
         logger.info("Shutdown complete.")
 
 def main():
@@ -2,28 +2,80 @@ import yaml
 import cv2
 import numpy as np
 import os
+import copy
 import logging
+import functools
+
+try:
+    # libyaml-backed loader, much faster when PyYAML was built with it
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+__all__ = [
+    'load_config',
+    'setup_logger',
+    'pin_current_thread',
+    'mask_to_polygon',
+    'ensure_directories',
+    'format_yolo_label',
+    'dhash',
+]
 
 def load_config(config_path):
     """
     Load YAML configuration file.
+    Parsed files are cached by path and modification time; every call returns
+    its own copy, so callers are free to modify it.
+    """
+    return copy.deepcopy(_parse_config(config_path, os.path.getmtime(config_path)))
+
+@functools.lru_cache(maxsize=4)
+def _parse_config(config_path, mtime):
+    """
+    Parse a YAML file once per (path, mtime). The C loader decodes the bytes itself.
     """
-    with open(config_path, 'r') as f:
-        return yaml.safe_load(f)
+    with open(config_path, 'rb') as f:
+        return yaml.load(f, Loader=SafeLoader)
 
 def setup_logger(name, level=logging.INFO):
     """
     Setup a standard logger with formatting.
+    Safe to call repeatedly: an already configured logger is returned as is.
     """
+    logger = logging.getLogger(name)
+    if logger.handlers:
+        return logger
+    
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     handler = logging.StreamHandler()
     handler.setFormatter(formatter)
     
-    logger = logging.getLogger(name)
     logger.setLevel(level)
     logger.addHandler(handler)
+    # The handler above already emits; don't repeat records through a configured root logger
+    logger.propagate = False
     return logger
 
+def pin_current_thread(cores):
+    """
+    Pin the calling thread to the given CPU core(s). Linux only.
+    Args:
+        cores: Core index or iterable of indices; None leaves the thread unpinned.
+    Returns:
+        True if the affinity was applied.
+    """
+    if cores is None or not hasattr(os, 'sched_setaffinity'):
+        return False
+    if isinstance(cores, int):
+        cores = [cores]
+    try:
+        # pid 0 means the calling thread on Linux
+        os.sched_setaffinity(0, set(cores))
+        return True
+    except (OSError, ValueError):
+        return False
+
 def mask_to_polygon(mask, epsilon_factor=0.001):
     """
     Convert a binary mask to a polygon for YOLO segmentation format.
@@ -34,24 +86,34 @@ def mask_to_polygon(mask, epsilon_factor=0.001):
         List of normalized points [x1, y1, x2, y2, ...]
     """
     h, w = mask.shape
+    # (x, y) divisor, built once per mask
+    size = np.array([w, h], dtype=np.float32)
     contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     
     polygons = []
     for contour in contours:
+        # Fewer than 3 points cannot form a polygon
+        if len(contour) < 3:
+            continue
+        # Cheap prefilter: a contour never covers more than its bounding box
+        _, _, bw, bh = cv2.boundingRect(contour)
+        if bw * bh < 10:
+            continue
         if cv2.contourArea(contour) < 10: # Filter small noise
             continue
-            
-        epsilon = epsilon_factor * cv2.arcLength(contour, True)
-        approx = cv2.approxPolyDP(contour, epsilon, True)
         
-        # Flatten and normalize
-        points = approx.flatten().astype(float)
+        if len(contour) < 8:
+            # CHAIN_APPROX_SIMPLE already left only the corners
+            approx = contour
+        else:
+            epsilon = epsilon_factor * cv2.arcLength(contour, True)
+            approx = cv2.approxPolyDP(contour, epsilon, True)
         
-        # Normalize coordinates
-        points[0::2] /= w
-        points[1::2] /= h
+        # Normalize x and y in one broadcast divide, then flatten
+        points = approx.reshape(-1, 2).astype(np.float32)
+        points /= size
         
-        polygons.append(points.tolist())
+        polygons.append(points.ravel().tolist())
         
     return polygons
 
@@ -75,8 +137,19 @@ def format_yolo_label(class_id, polygons):
     Format polygons into YOLO segmentation line.
     class_id x1 y1 x2 y2 ...
     """
-    lines = []
-    for poly in polygons:
-        line = f"{class_id} " + " ".join([f"{p:.6f}" for p in poly])
-        lines.append(line)
-    return lines
+    # Built once per call instead of per polygon
+    prefix = f"{class_id} "
+    fmt = "%.6f".__mod__
+    return [prefix + " ".join(map(fmt, poly)) for poly in polygons]
+
+def dhash(image, hash_size=8):
+    """
+    Difference hash of an image as an int of hash_size * hash_size bits.
+    Near-identical images differ in only a few bits (compare with XOR + popcount).
+    """
+    # Shrink first so the colour conversion only touches (hash_size + 1) x hash_size pixels
+    small = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    bits = np.packbits(small[:, 1:] > small[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')